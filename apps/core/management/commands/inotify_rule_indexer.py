@@ -1,13 +1,26 @@
+import json
 import os
+import re
+import signal
+import threading
+import time
 import typing
-from hashlib import md5
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import md5, sha256
 
 import plyara
 from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from plyara.exceptions import ParseError
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from yarawesome.utils import search_index
+from apps.core.middleware import Daemon
+from apps.core.models import IndexedRuleFile
+from apps.rules.models import ImportYaraRuleJob, YaraRule
+from yarawesome import config
+from yarawesome.utils import list_files_recursive, search_index
 from yarawesome.settings import MEDIA_ROOT
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yarawesome.settings")
@@ -44,51 +57,215 @@ def parse_yara_rule_from_index(yara_rules_index_path: str) -> typing.List[dict]:
     return collection_rules
 
 
-def parse_yara_rules_from_raw(yara_rules_string: str) -> typing.List[dict]:
+def get_yara_rule_fingerprint(parsed_yara_rule: dict) -> str:
+    """
+    Compute the rule_id of a parsed YARA rule, from its name, scopes (private, global), tags, strings, condition and
+    meta. Whitespace, the order of the meta fields and tags and the position of the rule in its file do not change it.
+
+    Args:
+        parsed_yara_rule: A rule as parsed by plyara.
+
+    Returns: The MD5 hex digest of the normalized rule.
+    """
+    strings = []
+    for string in parsed_yara_rule.get("strings", []):
+        value = string["value"]
+        if string["type"] == "byte":
+            value = "".join(value.split()).lower()
+        strings.append(
+            [
+                string["name"],
+                string["type"],
+                value,
+                sorted(string.get("modifiers", [])),
+            ]
+        )
+    normalized_rule = {
+        "name": parsed_yara_rule["rule_name"],
+        "strings": strings,
+        "condition": parsed_yara_rule.get("condition_terms", []),
+        "meta": sorted(
+            (
+                [key, value]
+                for field in parsed_yara_rule.get("metadata", [])
+                for key, value in field.items()
+            ),
+            key=json.dumps,
+        ),
+    }
+    # Only set when present, so the rule_ids of rules without them are unchanged.
+    for key in ("scopes", "tags"):
+        if parsed_yara_rule.get(key):
+            normalized_rule[key] = sorted(parsed_yara_rule[key])
+    return md5(
+        json.dumps(normalized_rule, sort_keys=True, separators=(",", ":")).encode(
+            "utf-8"
+        )
+    ).hexdigest()
+
+
+def get_line_offsets(text: str) -> typing.List[int]:
+    """
+    Get the offset at which each line of a text starts, so lines can be sliced out without splitting the text.
+
+    Args:
+        text: The text.
+
+    Returns: The offsets; the offset of line n (counting from 1) is at index n - 1.
+    """
+    line_offsets = [0]
+    offset = text.find("\n")
+    while offset != -1:
+        line_offsets.append(offset + 1)
+        offset = text.find("\n", offset + 1)
+    return line_offsets
+
+
+def find_yara_rule_start(
+    yara_rules_string: str,
+    line_offsets: typing.List[int],
+    parsed_yara_rule: dict,
+    search_from: int = 0,
+) -> int:
+    """
+    Find the offset of a parsed rule's header (including its private/global scopes) in the source it was parsed from.
+
+    Args:
+        yara_rules_string: The source of the rules.
+        line_offsets: The line offsets of the source, as returned by get_line_offsets.
+        parsed_yara_rule: A rule as parsed by plyara.
+        search_from: An offset the rule is known to start after; the end of the previous rule.
+
+    Returns: The offset of the rule header, or the start of its first line if the header cannot be found.
+    """
+    line_start = max(line_offsets[parsed_yara_rule["start_line"] - 1], search_from)
+    header = re.compile(
+        rf"(?:(?:private|global)\s+)*rule\s+{re.escape(parsed_yara_rule['rule_name'])}\b"
+    )
+    match = header.search(yara_rules_string, line_start)
+    if not match:
+        return line_start
+    return match.start()
+
+
+def parse_yara_rules_from_raw(yara_rules_string: str) -> typing.Iterator[dict]:
     """
     Parse YARA rules from a string and extract relevant information.
+    The source of each rule is sliced out of the string by offset, so the string is only scanned once.
+
+    plyara parses the whole string up front, so parse errors are raised by this call; the rules are flattened as
+    they are consumed.
     Args:
         yara_rules_string: A string containing one or more YARA rules
 
-    Returns: A list of dictionaries containing parsed YARA rule information.
+    Returns: An iterator over dictionaries containing parsed YARA rule information.
 
     """
     parser = plyara.Plyara()
-    flattened_rules = []
     parsed_yara_rules = parser.parse_string(yara_rules_string)
+    return _flatten_yara_rules(yara_rules_string, parsed_yara_rules)
 
-    for parsed_yara_rule in parsed_yara_rules:
-        rule_start_line = parsed_yara_rule["start_line"]
-        rule_end_line = parsed_yara_rule["stop_line"]
-        rule_content = "\n".join(
-            yara_rules_string.split("\n")[rule_start_line:rule_end_line]
-        )
-        if not rule_content.strip().startswith("{"):
-            rule_content = "{\n" + rule_content
-        if not rule_content.strip().endswith("}"):
-            rule_content = rule_content + "\n}"
+
+def _flatten_yara_rules(
+    yara_rules_string: str, parsed_yara_rules: typing.List[dict]
+) -> typing.Iterator[dict]:
+    """
+    Flatten the rules plyara parsed out of a string, slicing the source of each rule out of the string.
+
+    Args:
+        yara_rules_string: The string the rules were parsed from.
+        parsed_yara_rules: The rules as parsed by plyara, in the order they appear in the string.
+
+    Returns: An iterator over dictionaries containing the content, rule_id, search fields and parse of each rule.
+    """
+    line_offsets = get_line_offsets(yara_rules_string)
+
+    rule_start = None
+    search_from = 0
+    for i, parsed_yara_rule in enumerate(parsed_yara_rules):
+        if rule_start is None:
+            rule_start = find_yara_rule_start(
+                yara_rules_string, line_offsets, parsed_yara_rule, search_from
+            )
+        # A rule ends with its last line, unless the next rule starts on that line.
+        next_rule_start = None
+        rule_end = len(yara_rules_string)
+        if parsed_yara_rule["stop_line"] < len(line_offsets):
+            rule_end = line_offsets[parsed_yara_rule["stop_line"]]
+        if (
+            i + 1 < len(parsed_yara_rules)
+            and parsed_yara_rules[i + 1]["start_line"] == parsed_yara_rule["stop_line"]
+        ):
+            next_rule_start = find_yara_rule_start(
+                yara_rules_string,
+                line_offsets,
+                parsed_yara_rules[i + 1],
+                rule_start + 1,
+            )
+            rule_end = next_rule_start
         flattened_rule = {
-            "content": f"rule {parsed_yara_rule['rule_name']}\n" + rule_content,
-            "rule_id": md5(
-                "".join(sorted(str(val) for val in parsed_yara_rule.values())).encode(
-                    "utf-8"
-                )
-            ).hexdigest(),
-            "name": parsed_yara_rule["rule_name"],
-            "condition": " ".join(parsed_yara_rule.get("condition_terms", [])),
-            "imports": parsed_yara_rule.get("imports", []),
-            "variables": [item["name"] for item in parsed_yara_rule.get("strings", [])],
-            "values": [item["value"] for item in parsed_yara_rule.get("strings", [])],
+            "content": yara_rules_string[rule_start:rule_end].strip(),
+            "rule_id": get_yara_rule_fingerprint(parsed_yara_rule),
+            **search_index.get_parsed_yara_rule_search_fields(parsed_yara_rule),
+        }
+        # Stored with the rule's body in the database, so it never has to be parsed again; not indexed.
+        flattened_rule["parsed"] = {
+            key: value
+            for key, value in parsed_yara_rule.items()
+            if key not in ("start_line", "stop_line")
         }
+        search_from = rule_end
+        rule_start = next_rule_start
+
+        yield flattened_rule
+
 
-        for meta_item in parsed_yara_rule.get("metadata", []):
-            flattened_rule[list(meta_item.keys())[0]] = list(meta_item.values())[0]
+def read_indexed_rule_file(
+    yara_rule_path: str, known_hash: typing.Optional[str] = None, lazy: bool = False
+) -> typing.Optional[dict]:
+    """
+    Read a rule file for the inotify rule indexer, parsing its rules only if its content changed.
+
+    Args:
+        yara_rule_path: The path of the rule file.
+        known_hash: The SHA-256 of the file when it was last indexed, if it was.
+        lazy: Return the rules as an iterator, flattening each as it is consumed, rather than a list.
 
-        flattened_rules.append(flattened_rule)
-    return flattened_rules
+    Returns: The size, mtime, hash and path of the file, and its parsed rules under "rules", or None there if the
+    content did not change. None if the file cannot be read or parsed.
+    """
+    try:
+        with open(yara_rule_path, "rb") as yara_rule_in:
+            stat = os.fstat(yara_rule_in.fileno())
+            yara_rule_content = yara_rule_in.read()
+    except OSError as e:
+        print(f"Could not read {yara_rule_path}: {e}")
+        return None
+    indexed_rule_file = {
+        "path": yara_rule_path,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "hash": sha256(yara_rule_content).hexdigest(),
+        "rules": None,
+    }
+    if indexed_rule_file["hash"] == known_hash:
+        return indexed_rule_file
+    try:
+        flattened_rules = parse_yara_rules_from_raw(yara_rule_content.decode("utf-8"))
+    except UnicodeDecodeError:
+        flattened_rules = iter([])
+    except ParseError as e:
+        print(f"Could not parse {yara_rule_path}: {e}")
+        return None
+    flattened_rules = (
+        {**flattened_rule, "path_on_disk": yara_rule_path}
+        for flattened_rule in flattened_rules
+    )
+    indexed_rule_file["rules"] = flattened_rules if lazy else list(flattened_rules)
+    return indexed_rule_file
 
 
-def parse_yara_rules_from_path(yara_rule_path: str) -> typing.List[dict]:
+def parse_yara_rules_from_path(yara_rule_path: str) -> typing.Iterator[dict]:
     """
     Parse YARA rules from a file or a string and extract relevant information.
 
@@ -96,25 +273,154 @@ def parse_yara_rules_from_path(yara_rule_path: str) -> typing.List[dict]:
         yara_rule_path (str): A file path containing one or more YARA rules
 
     Returns:
-        List[dict]: A list of dictionaries containing parsed YARA rule information.
+        Iterator[dict]: An iterator over dictionaries containing parsed YARA rule information.
     """
     try:
         with open(yara_rule_path, "r") as yara_rule_in:
             yara_rule_content = yara_rule_in.read()
     except UnicodeDecodeError:
-        return []
+        return
 
-    flattened_rules = parse_yara_rules_from_raw(yara_rule_content)
-    for flattened_rule in flattened_rules:
+    for flattened_rule in parse_yara_rules_from_raw(yara_rule_content):
         flattened_rule["path_on_disk"] = yara_rule_path
-    return flattened_rules
+        yield flattened_rule
+
+
+def record_indexed_rule_files(indexed_rule_files: typing.Iterable[dict]) -> None:
+    """
+    Record what was indexed from a set of rule files, so the inotify rule indexer only indexes them again once they
+    change.
+
+    Args:
+        indexed_rule_files: Files as returned by read_indexed_rule_file, with the rule_ids indexed from them under
+        "rule_ids".
+    """
+    IndexedRuleFile.objects.bulk_create(
+        [
+            IndexedRuleFile(
+                path=os.path.abspath(indexed_rule_file["path"]),
+                size=indexed_rule_file["size"],
+                mtime=indexed_rule_file["mtime"],
+                hash=indexed_rule_file["hash"],
+                rule_ids=indexed_rule_file["rule_ids"],
+            )
+            for indexed_rule_file in indexed_rule_files
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["path"],
+        update_fields=["size", "mtime", "hash", "rule_ids"],
+    )
+
+
+def get_import_id_from_path(yara_rule_path: str) -> typing.Optional[int]:
+    """
+    Get the ID of the import job an extracted rule file belongs to, from its "<import_id>_" filename prefix.
+
+    Args:
+        yara_rule_path: The path of the rule file.
+
+    Returns: The import ID, or None if the file was not extracted by an import.
+    """
+    prefix = os.path.basename(yara_rule_path).split("_")[0]
+    if not prefix.isdigit():
+        return None
+    return int(prefix)
+
+
+def is_yara_rule_path(path: str) -> bool:
+    return path.lower().endswith(".yara") or path.lower().endswith(".yar")
+
+
+class CoalescingQueue:
+    """
+    A queue of paths, each released once no event has been seen for it for a debounce period.
+    Repeated events for a queued path only push back its release.
+    """
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self._deadlines: typing.Dict[str, float] = {}
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._deadlines)
+
+    def put(self, path: str) -> None:
+        with self._condition:
+            self._deadlines[path] = time.monotonic() + self.debounce
+            self._condition.notify()
+
+    def close(self) -> None:
+        """
+        Release every queued path immediately, and stop waiting for new ones.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get_batch(self, max_size: int) -> typing.List[str]:
+        """
+        Wait for queued paths to settle, and take up to max_size of them.
+
+        Args:
+            max_size: The maximum number of paths to take.
+
+        Returns: The paths; empty once the queue is closed and drained.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready = [
+                    path
+                    for path, deadline in sorted(
+                        self._deadlines.items(), key=lambda item: item[1]
+                    )
+                    if self._closed or deadline <= now
+                ][:max_size]
+                if ready:
+                    for path in ready:
+                        del self._deadlines[path]
+                    return ready
+                if self._closed:
+                    return []
+                # Wake up regularly, so signal handlers get a chance to run.
+                timeout = 1.0
+                if self._deadlines:
+                    timeout = min(timeout, min(self._deadlines.values()) - now)
+                self._condition.wait(timeout)
 
 
 class RuleIndexHandler(FileSystemEventHandler):
+    """
+    Queue every YARA rule file that is created, modified, moved or deleted in the watched directory.
+    """
+
+    def __init__(self, queue: CoalescingQueue):
+        super().__init__()
+        self.queue = queue
+
+    def queue_path(self, path: str) -> None:
+        if is_yara_rule_path(path):
+            self.queue.put(os.path.abspath(path))
+
+    def on_created(self, event):
+        self.on_modified(event)
+
+    def on_deleted(self, event):
+        self.on_modified(event)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        self.queue_path(event.src_path)
+        self.queue_path(event.dest_path)
+
     def on_modified(self, event):
         """
-        Handle a file system event. If a new YARA rule is added, index it.
-        If a new YARA rule collection is added, index all the rules in the collection.
+        Handle a file system event. If a YARA rule file is added, changed or removed, queue it to be indexed.
         Args:
             event: The file system event to handle.
 
@@ -123,23 +429,250 @@ class RuleIndexHandler(FileSystemEventHandler):
         """
         if event.is_directory:
             return
-        if not event.src_path.lower().endswith(
-            ".yara"
-        ) and not event.src_path.lower().endswith(".yar"):
+        self.queue_path(event.src_path)
+
+
+class RuleIndexDaemon(Daemon):
+    """
+    Watch a directory for YARA rule files, and index them in batches once they stop changing.
+
+    Files are parsed on a pool of worker processes, and the rules of each import collection are written to the
+    database and search backend in bulk. What was indexed from each file is kept in IndexedRuleFile records, so on
+    startup only the files that changed while the daemon was down are indexed again, and rules are removed along
+    with their files. SIGINT and SIGTERM stop the watcher, index whatever is queued, and exit.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        debounce: float = 2.0,
+        workers: int = 1,
+        batch_size: int = 100,
+    ):
+        self.path = os.path.abspath(path)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = CoalescingQueue(debounce)
+        self.observer = Observer()
+        self.observer.schedule(RuleIndexHandler(self.queue), path, recursive=True)
+
+    def stop(self, *args) -> None:
+        self.queue.close()
+
+    def reconcile(self) -> int:
+        """
+        Queue every rule file that was added, changed or removed since it was last indexed. Files whose size and
+        mtime are unchanged are trusted to be unchanged; the others are hashed once they are dequeued.
+
+        Returns: The number of files queued.
+        """
+        yara_rule_paths = {
+            path
+            for path in list_files_recursive(self.path)
+            if is_yara_rule_path(path) and get_import_id_from_path(path) is not None
+        }
+        indexed_rule_files = {
+            path: (size, mtime)
+            for path, size, mtime in IndexedRuleFile.objects.filter(
+                path__startswith=os.path.join(self.path, "")
+            ).values_list("path", "size", "mtime")
+        }
+        changed = 0
+        for yara_rule_path in yara_rule_paths:
+            try:
+                stat = os.stat(yara_rule_path)
+            except OSError:
+                continue
+            if indexed_rule_files.get(yara_rule_path) == (stat.st_size, stat.st_mtime):
+                continue
+            self.queue.put(yara_rule_path)
+            changed += 1
+        removed = indexed_rule_files.keys() - yara_rule_paths
+        for yara_rule_path in removed:
+            self.queue.put(yara_rule_path)
+        print(
+            f"Queued {changed} changed and {len(removed)} removed rule files for indexing."
+        )
+        return changed + len(removed)
+
+    def remove_stale_rules(
+        self,
+        import_id: int,
+        collection_name: str,
+        rule_ids: typing.Set[str],
+    ) -> None:
+        """
+        Remove rules no longer found in any indexed file of their import collection.
+
+        Args:
+            import_id: The ID of the import the rules belong to.
+            collection_name: The name of the import collection.
+            rule_ids: The rule_ids of the rules no longer found in the files they were indexed from.
+        """
+        # rule_import.tasks imports this module's parsers.
+        from apps.rule_import.tasks import get_import_collection_name
+
+        for path, indexed_rule_ids in IndexedRuleFile.objects.filter(
+            path__contains=f"/{import_id}_"
+        ).values_list("path", "rule_ids"):
+            if get_import_id_from_path(path) != import_id:
+                continue
+            if get_import_collection_name(path) != collection_name:
+                continue
+            rule_ids = rule_ids - set(indexed_rule_ids)
+        if not rule_ids:
             return
-        for rule in parse_yara_rules_from_path(event.src_path):
-            search_index.index_yara_rule(rule)
+        search_index.delete_yara_rules(
+            YaraRule.objects.filter(
+                import_job_id=import_id,
+                collection__name=collection_name,
+                rule_id__in=rule_ids,
+            )
+        )
+
+    def index_batch(
+        self, executor: ProcessPoolExecutor, yara_rule_paths: typing.List[str]
+    ) -> int:
+        """
+        Parse a batch of rule files, index their rules in bulk, and remove the rules of files that changed or
+        disappeared since they were last indexed.
+
+        Args:
+            executor: The pool to parse the files on.
+            yara_rule_paths: The paths of the rule files.
+
+        Returns: The number of rules processed.
+        """
+        # rule_import.tasks imports this module's parsers.
+        from apps.rule_import.tasks import (
+            finalize_yara_rules_import,
+            get_import_collection_name,
+        )
+
+        # Files of an import that is still running belong to the import task, which records them once indexed.
+        # An import running for longer than YARA_IMPORT_TIMEOUT lost its worker, and is never finalized.
+        import_ids = {get_import_id_from_path(path) for path in yara_rule_paths}
+        owned_import_ids = set(
+            ImportYaraRuleJob.objects.filter(
+                Q(importing=False)
+                | Q(
+                    created_time__lt=timezone.now()
+                    - timezone.timedelta(seconds=config.YARA_IMPORT_TIMEOUT)
+                ),
+                id__in=import_ids - {None},
+            ).values_list("id", flat=True)
+        )
+        yara_rule_paths = [
+            path
+            for path in yara_rule_paths
+            if get_import_id_from_path(path) in owned_import_ids
+        ]
+        indexed_rule_files = {
+            indexed_rule_file.path: indexed_rule_file
+            for indexed_rule_file in IndexedRuleFile.objects.filter(
+                path__in=yara_rule_paths
+            )
+        }
+        existing_paths = [path for path in yara_rule_paths if os.path.exists(path)]
+        read_rule_files = executor.map(
+            read_indexed_rule_file,
+            existing_paths,
+            [
+                getattr(indexed_rule_files.get(path), "hash", None)
+                for path in existing_paths
+            ],
+        )
+
+        parsed_rules_by_collection = {}
+        stale_rule_ids_by_collection = {}
+        updated_rule_files = []
+        for yara_rule_path, read_rule_file in zip(existing_paths, read_rule_files):
+            if not read_rule_file:
+                continue
+            previous = indexed_rule_files.pop(yara_rule_path, None)
+            rule_ids = previous.rule_ids if previous else []
+            if read_rule_file["rules"] is not None:
+                collection = (
+                    get_import_id_from_path(yara_rule_path),
+                    get_import_collection_name(yara_rule_path),
+                )
+                parsed_rules_by_collection.setdefault(collection, []).extend(
+                    read_rule_file["rules"]
+                )
+                rule_ids = [rule["rule_id"] for rule in read_rule_file["rules"]]
+                if previous:
+                    stale_rule_ids_by_collection.setdefault(collection, set()).update(
+                        set(previous.rule_ids) - set(rule_ids)
+                    )
+            read_rule_file["rule_ids"] = rule_ids
+            updated_rule_files.append(read_rule_file)
+        # What is left had its file removed.
+        removed_rule_files = [
+            indexed_rule_file
+            for path, indexed_rule_file in indexed_rule_files.items()
+            if path not in existing_paths
+        ]
+        for indexed_rule_file in removed_rule_files:
+            stale_rule_ids_by_collection.setdefault(
+                (
+                    get_import_id_from_path(indexed_rule_file.path),
+                    get_import_collection_name(indexed_rule_file.path),
+                ),
+                set(),
+            ).update(indexed_rule_file.rule_ids)
+
+        indexed_by_import = {}
+        for (
+            import_id,
+            collection_name,
+        ), parsed_rules in parsed_rules_by_collection.items():
+            indexed_by_import.setdefault(import_id, []).append(
+                search_index.bulk_index_imported_yara_rules(
+                    parsed_rules, collection_name=collection_name, import_id=import_id
+                )
+            )
+        IndexedRuleFile.objects.filter(
+            id__in=[indexed_rule_file.id for indexed_rule_file in removed_rule_files]
+        ).delete()
+        record_indexed_rule_files(updated_rule_files)
+        for (
+            import_id,
+            collection_name,
+        ), rule_ids in stale_rule_ids_by_collection.items():
+            if rule_ids:
+                self.remove_stale_rules(import_id, collection_name, rule_ids)
+        for import_id, indexed_counts in indexed_by_import.items():
+            finalize_yara_rules_import(indexed_counts, import_id)
+        return sum(sum(counts) for counts in indexed_by_import.values())
+
+    def run(self) -> bool:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        # Watch first, so nothing changed during the startup scan is missed.
+        self.observer.start()
+        print(f"Watching {self.path} for YARA rules.")
+        self.reconcile()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                yara_rule_paths = self.queue.get_batch(self.batch_size)
+                if not yara_rule_paths:
+                    break
+                try:
+                    self.index_batch(executor, yara_rule_paths)
+                except Exception as e:
+                    print(f"Error indexing {len(yara_rule_paths)} rule files: {e}")
+        self.observer.stop()
+        self.observer.join()
+        return True
 
 
 class Command(BaseCommand):
     help = "Watch for newly added YARA rules and index them"
 
     def handle(self, *args, **options):
-        rule_indexing_handler = RuleIndexHandler()
-        rule_indexing_observer = Observer()
-        rule_indexing_observer.schedule(
-            rule_indexing_handler,
+        RuleIndexDaemon(
             f"{MEDIA_ROOT}/rule-uploads/",
-            recursive=True,
-        )
-        rule_indexing_observer.start()
+            debounce=config.YARA_INDEXER_DEBOUNCE,
+            workers=config.YARA_INDEXER_WORKERS,
+            batch_size=config.YARA_INDEXER_BATCH_SIZE,
+        ).run()
@@ -1,10 +1,8 @@
-import plyara
-import plyara.exceptions
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
 
-from apps.rules.models import YaraRule, YaraRuleCollection
-from yarawesome.utils import database, search_index
+from apps.rules.models import YaraRuleCollection
+from yarawesome.utils import search_index
 
 
 def build_rule_index_from_private_collection(
@@ -20,21 +18,7 @@ def build_rule_index_from_private_collection(
     """
     if user != collection.user:
         return None
-    yara_rules = YaraRule.objects.filter(collection=collection, user=user).all()
-    rule_chunk = []
-    upload_results = []
-    for rule in yara_rules.iterator():
-        try:
-            yara_rule = database.parse_lookup_rule_response(rule)["yara_rule"]
-            rule_chunk.append(yara_rule)
-        except plyara.exceptions.ParseError:
-            print("Encountered error while parsing rule: {}".format(rule.id))
-            continue
-        if len(rule_chunk) == 600:
-            upload_results.append(search_index.bulk_index_yara_rules(rule_chunk))
-            rule_chunk = []
-    upload_results.append(search_index.bulk_index_yara_rules(rule_chunk))
-    return all(upload_results)
+    return search_index.index_yara_rule_collection(collection)
 
 
 class Command(BaseCommand):
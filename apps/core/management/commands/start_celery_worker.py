@@ -3,9 +3,20 @@ from celery import Celery
 
 
 class Command(BaseCommand):
-    help = "Start the Celery worker"
+    help = "Start the Celery worker, along with the beat scheduler running CELERY_BEAT_SCHEDULE"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-beat",
+            action="store_true",
+            help="Do not run the beat scheduler in this worker; exactly one worker should run it.",
+        )
 
     def handle(self, *args, **options):
         celery_app = Celery("yarawesome")
         celery_app.config_from_object("django.conf:settings", namespace="CELERY")
-        celery_app.worker_main(["worker", "--loglevel=info"])
+        argv = ["worker", "--loglevel=info"]
+        if not options["no_beat"]:
+            # Runs the periodic index reconciliation and rule body garbage collection.
+            argv.append("--beat")
+        celery_app.worker_main(argv)
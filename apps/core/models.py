@@ -1,3 +1,20 @@
 import re
 from django.contrib.auth.models import User
 from django.db import models
+
+
+class IndexedRuleFile(models.Model):
+    """
+    A rule file under rule-uploads/, as it was when the inotify rule indexer last indexed it.
+    """
+
+    id = models.AutoField(primary_key=True)
+    path = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    hash = models.CharField(max_length=64)
+    # The rule_ids of the rules parsed from the file.
+    rule_ids = models.JSONField(default=list)
+
+    def __str__(self):
+        return self.path
@@ -1,17 +1,69 @@
 import json
-from django.http import HttpResponse
+import os
+import shutil
+import typing
+from celery.result import AsyncResult
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.db import IntegrityError, transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from yarawesome.utils import database
-from apps.core.management.commands import publish_collection_index
+from yarawesome import config
+from yarawesome.utils import compiler, database, search_index
 from apps.rules.models import YaraRule, YaraRuleCollection
+from .models import YaraRuleCollectionChange
 
 from .serializers import (
+    YaraRuleCollectionChangesRequest,
     YaraRuleCollectionDeleteRequest,
+    YaraRuleCollectionDownloadRequest,
     YaraRuleCollectionPublishRequest,
     YaraRuleCollectionUpdateRequest,
 )
+from .tasks import index_yara_rule_collection, schedule_yara_rule_collection_artifacts
+
+
+def open_collection_artifact(
+    collection_id: int, version: int, extension: str
+) -> typing.Optional[typing.BinaryIO]:
+    """
+    Open a pre-built collection artifact.
+
+    Args:
+        collection_id: The id of the collection.
+        version: The content version of the collection.
+        extension: The extension of the artifact.
+
+    Returns: The open artifact, or None if it has not been built (or has since been removed).
+    """
+    try:
+        return open(
+            compiler.get_collection_artifact_path(collection_id, version, extension),
+            "rb",
+        )
+    except FileNotFoundError:
+        return None
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """
+    Check an ETag against an If-None-Match header, using the weak comparison it calls for.
+
+    Args:
+        etag: The ETag of the representation.
+        if_none_match: The value of the If-None-Match header; "*" or a comma-separated list of ETags.
+
+    Returns: True if the client already has the representation.
+    """
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
 
 
 class YaraRuleCollectionDownloadResource(APIView):
@@ -21,24 +73,134 @@ class YaraRuleCollectionDownloadResource(APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Download a YARA rule collection.
+        Download a YARA rule collection, optionally at a specific ?version=.
+        Pre-built artifacts are served as static files. Until the current version is built, the content is streamed
+        rule by rule. Both are gzipped when the client accepts it, and tagged with the collection's content version
+        so unchanged collections are answered with 304 Not Modified.
         """
-        collection_id = kwargs["collection_id"]
-        concat_rules = database.get_yara_rule_collection_content(
-            request.user, collection_id
-        )
-        if concat_rules:
-            collection_name = YaraRuleCollection.objects.get(id=collection_id).name
-            response = HttpResponse(
-                concat_rules,
+        serializer = YaraRuleCollectionDownloadRequest(
+            data={**request.query_params.dict(), **kwargs}
+        )
+        serializer.is_valid(raise_exception=True)
+        yara_rule_collection = database.get_downloadable_yara_rule_collection(
+            request.user, serializer.validated_data["collection_id"]
+        )
+        if not yara_rule_collection:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        version = serializer.validated_data.get("version", yara_rule_collection.version)
+
+        gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+        # The gzipped representation has different bytes, so it gets an ETag of its own.
+        etag = f'"{yara_rule_collection.id}-{version}{"-gzip" if gzipped else ""}"'
+        if etag_matches(etag, request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            patch_vary_headers(response, ("Accept-Encoding",))
+            return response
+
+        artifact = open_collection_artifact(
+            yara_rule_collection.id, version, "yara.gz" if gzipped else "yara"
+        )
+        if artifact:
+            response = FileResponse(artifact, content_type="application/x-yara")
+        elif version != yara_rule_collection.version:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        else:
+            schedule_yara_rule_collection_artifacts(yara_rule_collection.id)
+            content = database.iter_yara_rule_collection_content(yara_rule_collection)
+            if gzipped:
+                content = compress_sequence(chunk.encode("utf-8") for chunk in content)
+            response = StreamingHttpResponse(
+                content,
                 content_type="application/x-yara",
             )
-            response[
-                "Content-Disposition"
-            ] = f'attachment; filename="{collection_name}.yara"'
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        response["ETag"] = etag
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{yara_rule_collection.name}.yara"'
+        return response
+
+
+class YaraRuleCollectionCompiledResource(APIView):
+    """
+    A view to download a YARA rule collection compiled with yara.compile, ready for yara.load.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Download the compiled rules of a YARA rule collection, optionally at a specific ?version=.
+        The rules are compiled together into a single namespace.
+        """
+        serializer = YaraRuleCollectionDownloadRequest(
+            data={**request.query_params.dict(), **kwargs}
+        )
+        serializer.is_valid(raise_exception=True)
+        yara_rule_collection = database.get_downloadable_yara_rule_collection(
+            request.user, serializer.validated_data["collection_id"]
+        )
+        if not yara_rule_collection:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND,
+                data={"error": "Collection not found."},
+            )
+        version = serializer.validated_data.get("version", yara_rule_collection.version)
+
+        etag = f'"{yara_rule_collection.id}-{version}"'
+        if etag_matches(etag, request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
             return response
 
-        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        artifact = open_collection_artifact(yara_rule_collection.id, version, "yarc")
+        if not artifact:
+            if version == yara_rule_collection.version:
+                schedule_yara_rule_collection_artifacts(yara_rule_collection.id)
+            return Response(
+                status=status.HTTP_404_NOT_FOUND,
+                data={"error": "This version of the collection has not been compiled."},
+            )
+        response = FileResponse(artifact, content_type="application/octet-stream")
+        response["ETag"] = etag
+        response[
+            "Content-Disposition"
+        ] = f'attachment; filename="{yara_rule_collection.name}.yarc"'
+        return response
+
+
+class YaraRuleCollectionChangesResource(APIView):
+    """
+    A view to sync a YARA rule collection incrementally.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Return the rules added, modified and removed since the ?since= version of a collection.
+        Consumers poll with the returned "next" version until it reaches "version"; when "reset" is set they must
+        download the whole collection instead.
+        """
+        serializer = YaraRuleCollectionChangesRequest(
+            data={**request.query_params.dict(), **kwargs}
+        )
+        serializer.is_valid(raise_exception=True)
+        yara_rule_collection = database.get_downloadable_yara_rule_collection(
+            request.user, serializer.validated_data["collection_id"]
+        )
+        if not yara_rule_collection:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND,
+                data={"error": "Collection not found."},
+            )
+        return Response(
+            database.get_yara_rule_collection_changes(
+                yara_rule_collection,
+                serializer.validated_data["since"],
+                serializer.validated_data["max_results"],
+            ),
+            status=status.HTTP_200_OK,
+        )
 
 
 class YaraRuleCollectionResource(APIView):
@@ -75,7 +237,14 @@ class YaraRuleCollectionResource(APIView):
         yara_rule_collection.name = serializer.validated_data["name"]
         yara_rule_collection.description = serializer.validated_data["description"]
         yara_rule_collection.icon = serializer.validated_data["icon"]
-        yara_rule_collection.save()
+        try:
+            with transaction.atomic():
+                yara_rule_collection.save()
+        except IntegrityError:
+            return Response(
+                status=status.HTTP_409_CONFLICT,
+                data={"error": "The import already has a collection with this name."},
+            )
         return Response(
             status=status.HTTP_200_OK,
             data={
@@ -101,6 +270,10 @@ class YaraRuleCollectionResource(APIView):
                 data={"error": "Collection not found."},
             )
         yara_rule_collection.delete()
+        shutil.rmtree(
+            os.path.join(config.YARA_RULES_COLLECTIONS_DIRECTORY, str(collection_id)),
+            ignore_errors=True,
+        )
         return Response(status=status.HTTP_200_OK, data={"deleted": True})
 
 
@@ -111,7 +284,8 @@ class PublishYaraRuleCollectionResource(APIView):
 
     def put(self, request, *args, **kwargs):
         """
-        Publish a YARA rule collection.
+        Publish (or with {"public": false}, unpublish) a YARA rule collection, and re-index its rules in the
+        background.
         """
         set_to_public = True
         serializer = YaraRuleCollectionPublishRequest(data=kwargs)
@@ -128,30 +302,42 @@ class PublishYaraRuleCollectionResource(APIView):
                 return Response({"error": "Invalid JSON data"}, status=400)
             if not data.get("public"):
                 set_to_public = False
-        yara_rule_collection.public = set_to_public
-        if not publish_collection_index.build_rule_index_from_private_collection(
-            yara_rule_collection, request.user
-        ):
+        if not yara_rule_collection:
             return Response(
-                {"error": "Could not build the rule index."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                status=status.HTTP_404_NOT_FOUND,
+                data={"error": "Collection not found."},
             )
+        yara_rule_collection.public = set_to_public
         yara_rule_collection.save()
-        yara_rules = YaraRule.objects.filter(collection=yara_rule_collection)
-
-        for yara_rule in yara_rules:
-            yara_rule.public = set_to_public
-            yara_rule.save()
+        YaraRule.objects.filter(collection=yara_rule_collection).update(
+            public=set_to_public
+        )
+        database.record_yara_rule_collection_changes(
+            yara_rule_collection.id,
+            (
+                YaraRuleCollectionChange.PUBLISHED
+                if set_to_public
+                else YaraRuleCollectionChange.UNPUBLISHED
+            ),
+        )
+        search_index.bump_public_search_generation()
+        # Re-indexing a large collection outlasts the request; poll its progress with GET ?task_id=.
+        task = index_yara_rule_collection.delay(yara_rule_collection.id)
+        YaraRuleCollection.objects.filter(id=yara_rule_collection.id).update(
+            publish_task_id=task.id
+        )
         return Response(
-            data={"published": yara_rule_collection.public},
-            status=status.HTTP_200_OK,
+            data={"published": yara_rule_collection.public, "task_id": task.id},
+            status=status.HTTP_202_ACCEPTED,
         )
 
     def get(self, request, *args, **kwargs):
         """
-        Check if a YARA rule collection is published.
+        Check if a YARA rule collection is published, and the progress of the ?task_id= re-indexing it.
         """
-        serializer = YaraRuleCollectionPublishRequest(data=kwargs)
+        serializer = YaraRuleCollectionPublishRequest(
+            data={**request.query_params.dict(), **kwargs}
+        )
         serializer.is_valid(raise_exception=True)
         collection_id = serializer.validated_data["collection_id"]
         yara_rule_collection = YaraRuleCollection.objects.filter(
@@ -159,7 +345,22 @@ class PublishYaraRuleCollectionResource(APIView):
         ).first()
         if not yara_rule_collection:
             return Response(status=status.HTTP_404_NOT_FOUND)
+        data = {"published": yara_rule_collection.public}
+        if serializer.validated_data.get("task_id"):
+            # Only the task publishing this collection is reported, not any task the caller knows the id of.
+            if (
+                serializer.validated_data["task_id"]
+                != yara_rule_collection.publish_task_id
+            ):
+                return Response(
+                    status=status.HTTP_404_NOT_FOUND,
+                    data={"error": "Task not found."},
+                )
+            task = AsyncResult(serializer.validated_data["task_id"])
+            data["task"] = {"id": task.id, "state": task.state}
+            if isinstance(task.info, dict):
+                data["task"].update(task.info)
         return Response(
-            data={"published": yara_rule_collection.public},
+            data=data,
             status=status.HTTP_200_OK,
         )
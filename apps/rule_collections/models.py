@@ -14,9 +14,23 @@ class YaraRuleCollection(models.Model):
     name = models.CharField(max_length=64)
     description = models.CharField(max_length=32)
     icon = models.IntegerField(default=1)
+    # Incremented whenever the rules in the collection change; identifies a download of its content.
+    version = models.PositiveIntegerField(default=1)
+    # The task re-indexing the collection after it was last published or unpublished.
+    publish_task_id = models.CharField(max_length=255, blank=True, default="")
+    # Set while a build of the collection's artifacts is queued and has not started yet.
+    artifact_build_queued_time = models.DateTimeField(blank=True, null=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     import_job = models.ForeignKey(ImportYaraRuleJob, on_delete=models.CASCADE)
 
+    class Meta:
+        # An import writes each directory of rules to the collection named after it.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["import_job", "name"], name="unique_import_collection_name"
+            )
+        ]
+
     def get_rule_count(self):
         """
         Returns the count of YaraRule objects associated with this collection.
@@ -25,3 +39,36 @@ class YaraRuleCollection(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class YaraRuleCollectionChange(models.Model):
+    """
+    A model to represent a change to a YARA rule collection, recorded at the collection version it produced.
+    """
+
+    ADDED = "ADDED"
+    MODIFIED = "MODIFIED"
+    REMOVED = "REMOVED"
+    PUBLISHED = "PUBLISHED"
+    UNPUBLISHED = "UNPUBLISHED"
+    ACTION_CHOICES = [
+        (ADDED, "Added"),
+        (MODIFIED, "Modified"),
+        (REMOVED, "Removed"),
+        (PUBLISHED, "Published"),
+        (UNPUBLISHED, "Unpublished"),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    collection = models.ForeignKey(YaraRuleCollection, on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField()
+    # Empty for changes to the collection itself, e.g. publishing.
+    rule_id = models.CharField(max_length=32, blank=True, default="")
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+
+    class Meta:
+        indexes = [models.Index(fields=["collection", "sequence"])]
+
+    def __str__(self):
+        return f"{self.collection_id}@{self.sequence}: {self.action} {self.rule_id}"
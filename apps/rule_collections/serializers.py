@@ -5,6 +5,17 @@ class YaraRuleCollectionDeleteRequest(serializers.Serializer):
     collection_id = serializers.IntegerField(min_value=1)
 
 
+class YaraRuleCollectionDownloadRequest(serializers.Serializer):
+    collection_id = serializers.IntegerField(min_value=1)
+    version = serializers.IntegerField(min_value=1, required=False)
+
+
+class YaraRuleCollectionChangesRequest(serializers.Serializer):
+    collection_id = serializers.IntegerField(min_value=1)
+    since = serializers.IntegerField(min_value=0, default=0)
+    max_results = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+
+
 class YaraRuleCollectionUpdateRequest(serializers.Serializer):
     collection_id = serializers.IntegerField(min_value=1)
     name = serializers.CharField(max_length=128)
@@ -14,3 +25,4 @@ class YaraRuleCollectionUpdateRequest(serializers.Serializer):
 
 class YaraRuleCollectionPublishRequest(serializers.Serializer):
     collection_id = serializers.IntegerField(min_value=1)
+    task_id = serializers.CharField(max_length=255, required=False)
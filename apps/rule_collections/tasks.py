@@ -0,0 +1,153 @@
+import datetime
+import glob
+import gzip
+import os
+import shutil
+
+import yara
+from celery import shared_task
+from django.db.models import Q
+from django.utils import timezone
+from yarawesome import config
+from yarawesome.utils import compiler, database, search_index
+from apps.rules.models import YaraRuleCollection
+
+
+def remove_stale_collection_artifacts(collection_id: int, version: int) -> None:
+    """
+    Remove the artifacts of a collection's older versions, keeping the last YARA_COLLECTION_ARTIFACT_VERSIONS.
+
+    Args:
+        collection_id: The id of the collection.
+        version: The current content version of the collection.
+    """
+    for artifact_path in glob.glob(
+        os.path.join(config.YARA_RULES_COLLECTIONS_DIRECTORY, str(collection_id), "*")
+    ):
+        artifact_version = os.path.basename(artifact_path).split(".")[0]
+        if (
+            artifact_version.isdigit()
+            and int(artifact_version)
+            <= version - config.YARA_COLLECTION_ARTIFACT_VERSIONS
+        ):
+            try:
+                os.remove(artifact_path)
+            except FileNotFoundError:
+                pass
+
+
+def schedule_yara_rule_collection_artifacts(collection_id: int) -> bool:
+    """
+    Queue a build of a collection's artifacts, unless one is already queued. A queued build picks up every change
+    made before it starts, so a burst of changes produces a single build. The queued build is recorded on the
+    collection, so the web and worker processes agree on it whatever the cache backend.
+
+    Args:
+        collection_id: The id of the collection.
+
+    Returns: True if a build was queued.
+    """
+    now = timezone.now()
+    # A build that never started, e.g. because its message was lost, does not block new ones forever.
+    stale_time = now - datetime.timedelta(
+        seconds=config.YARA_COLLECTION_ARTIFACT_BUILD_DEBOUNCE
+    )
+    if (
+        not YaraRuleCollection.objects.filter(id=collection_id)
+        .filter(
+            Q(artifact_build_queued_time__isnull=True)
+            | Q(artifact_build_queued_time__lt=stale_time)
+        )
+        .update(artifact_build_queued_time=now)
+    ):
+        return False
+    build_yara_rule_collection_artifacts.delay(collection_id)
+    return True
+
+
+@shared_task
+def build_yara_rule_collection_artifacts(collection_id: int) -> bool:
+    """
+    Materialize the current version of a collection as a concatenated source file, a gzipped copy of it, and a
+    compiled ruleset. The rules are compiled together into a single namespace.
+
+    Builds are skipped when the current version is already built, and discarded when the collection changes while
+    building; the change queues a build of its own.
+
+    Returns: True if the artifacts of the current version exist.
+    """
+    # Changes from here on are not picked up by this build, so they may queue another one.
+    YaraRuleCollection.objects.filter(id=collection_id).update(
+        artifact_build_queued_time=None
+    )
+    yara_rule_collection = YaraRuleCollection.objects.filter(id=collection_id).first()
+    if not yara_rule_collection:
+        return False
+    version = yara_rule_collection.version
+    source_path = compiler.get_collection_artifact_path(collection_id, version)
+    if os.path.exists(source_path):
+        return True
+
+    os.makedirs(os.path.dirname(source_path), exist_ok=True)
+    # Artifacts are written to temporary paths first, so a download never serves a partial file.
+    temp_suffix = f".{os.getpid()}.tmp"
+    artifact_paths = {source_path: f"{source_path}{temp_suffix}"}
+    gzip_path = compiler.get_collection_artifact_path(collection_id, version, "yara.gz")
+    artifact_paths[gzip_path] = f"{gzip_path}{temp_suffix}"
+    with open(artifact_paths[source_path], "w") as source_out:
+        for chunk in database.iter_yara_rule_collection_content(yara_rule_collection):
+            source_out.write(chunk)
+    with open(artifact_paths[source_path], "rb") as source_in, gzip.open(
+        artifact_paths[gzip_path], "wb"
+    ) as gzip_out:
+        shutil.copyfileobj(source_in, gzip_out)
+    try:
+        _, compiled_rules, _ = compiler.compile_yara_rules(
+            yara_rule_collection.yararule_set.all()
+        )
+        compiled_path = compiler.get_collection_artifact_path(
+            collection_id, version, "yarc"
+        )
+        artifact_paths[compiled_path] = f"{compiled_path}{temp_suffix}"
+        compiled_rules.save(filepath=artifact_paths[compiled_path])
+    except yara.Error as e:
+        print(f"Could not compile collection {collection_id} (v{version}): {e}")
+
+    if (
+        YaraRuleCollection.objects.filter(id=collection_id)
+        .values_list("version", flat=True)
+        .first()
+        != version
+    ):
+        for temp_path in artifact_paths.values():
+            os.remove(temp_path)
+        return False
+    # The source is moved last; its presence marks the version as built.
+    for artifact_path, temp_path in reversed(artifact_paths.items()):
+        os.replace(temp_path, artifact_path)
+    remove_stale_collection_artifacts(collection_id, version)
+    return True
+
+
+@shared_task(bind=True)
+def index_yara_rule_collection(self, collection_id: int) -> dict:
+    """
+    Re-index every rule in a collection after it is published or unpublished, reporting progress as a PROGRESS
+    state with "indexed" and "total" counts.
+
+    Returns: The number of rules indexed, the total, and whether every bulk insert succeeded.
+    """
+    yara_rule_collection = YaraRuleCollection.objects.filter(id=collection_id).first()
+    if not yara_rule_collection:
+        return {"indexed": 0, "total": 0, "success": False}
+    progress = {"indexed": 0, "total": 0}
+
+    def on_progress(indexed: int, total: int) -> None:
+        progress.update(indexed=indexed, total=total)
+        if self.request.id:
+            self.update_state(state="PROGRESS", meta=dict(progress))
+
+    success = search_index.index_yara_rule_collection(
+        yara_rule_collection, on_progress=on_progress
+    )
+    return {**progress, "success": success}
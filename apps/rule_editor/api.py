@@ -1,6 +1,5 @@
 import json
 
-import plyara
 import requests
 from plyara.exceptions import ParseError
 from rest_framework import status
@@ -23,12 +22,9 @@ def parse_lookup_rule_response_verbose(yara_rule: YaraRule) -> dict:
     Returns:
         dict: Parsed rule information.
     """
-    parser = plyara.Plyara()
-    raw_rule = yara_rule.content
-    parsed_yara_rule = parser.parse_string(raw_rule)[-1]
     yara_rule = {
-        **parsed_yara_rule,
-        "rule": raw_rule,
+        **database.get_parsed_yara_rule(yara_rule),
+        "rule": yara_rule.content,
     }
 
     return {"yara_rule": yara_rule}
@@ -73,12 +69,12 @@ class RuleEditorResource(APIView):
         yara_rule = data["yara_rule"]
 
         try:
-            parsed_yara_rule = inotify_rule_indexer.parse_yara_rules_from_raw(
-                yara_rule
-            )[0]
+            parsed_yara_rule = next(
+                inotify_rule_indexer.parse_yara_rules_from_raw(yara_rule)
+            )
         except ParseError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        except IndexError as e:
+        except StopIteration:
 
             return Response(
                 {"error": "No rule detected, perhaps missing closing bracket?"},
@@ -89,3 +85,24 @@ class RuleEditorResource(APIView):
 
         # Respond with a success message or appropriate response
         return Response({"message": "YARA rule updated successfully"})
+
+    def delete(self, request, *args, **kwargs):
+        """
+        Delete one of the user's rules.
+
+        Besides removing the rule from the database, this records its removal from its collection, invalidates the
+        compiled rulesets that include it and queues a rebuild of the collection's artifacts. The rule's documents
+        in the user's index, and in the public index if it was public, are re-synced rather than deleted outright,
+        since the same rule may remain in another collection.
+        """
+        serializer = RuleLookupSerializer(data=kwargs)
+        serializer.is_valid(raise_exception=True)
+        rule_id = serializer.validated_data["rule_id"]
+        yara_rule = database.lookup_yara_rule(rule_id, user=request.user)
+        if not yara_rule:
+            return Response(
+                {"error": "Could not locate a rule with this id."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        search_index.delete_yara_rule(yara_rule)
+        return Response({"deleted": True}, status=status.HTTP_200_OK)
@@ -7,6 +7,7 @@ from rest_framework.views import APIView
 from apps.rules.models import ImportYaraRuleJob, YaraRule, YaraRuleCollection
 
 from .serializers import CreateImportJobSerializer, ImportJobSerializer
+from .tasks import release_yara_rules_import
 
 
 def make_import_count_request(import_id: int) -> int:
@@ -31,14 +32,17 @@ class CreateImportJobResource(CreateAPIView):
     parser_classes = [MultiPartParser]
 
     def create(self, request, *args, **kwargs):
-        # Create the ImportYaraRuleJob instance
-        import_job = ImportYaraRuleJob(user=request.user)
-        import_job.save()
-
         # Create the serializer instance
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(import_id=import_job.id)
+
+        # The import task owns the extracted files until it is finalized, or fails.
+        import_job = ImportYaraRuleJob.objects.create(user=request.user, importing=True)
+        try:
+            serializer.save(import_id=import_job.id)
+        except Exception as e:
+            release_yara_rules_import(import_job.id, error=str(e))
+            raise
 
         # Return a JSON response
         response_data = {
@@ -10,6 +10,10 @@ class ImportYaraRuleJob(models.Model):
     id = models.AutoField(primary_key=True)
     created_time = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Set while the import task owns the extracted files; the inotify rule indexer leaves them alone until then.
+    importing = models.BooleanField(default=False)
+    # Why the import failed, if it did.
+    error = models.TextField(blank=True, default="")
 
     def __str__(self):
         return f"ImportYaraRuleJob {self.id} by {self.user.name}"
@@ -1,26 +1,135 @@
 import os
-from celery import shared_task
-from yarawesome.utils import search_index
+import typing
+
+from celery import chord, shared_task
+from yarawesome import config
+from yarawesome.utils import compiler, database, search_index
+from apps.rules.models import ImportYaraRuleJob, YaraRuleCollection
+from apps.rule_collections.tasks import schedule_yara_rule_collection_artifacts
 from apps.core.management.commands.inotify_rule_indexer import (
-    parse_yara_rules_from_path,
+    read_indexed_rule_file,
+    record_indexed_rule_files,
 )
 
 
 from yarawesome.utils import list_files_recursive
 
 
+def get_import_collection_name(yara_rule_path: str) -> str:
+    """
+    Get the name of the collection the rules in a file are imported into; the name of its directory.
+    """
+    return os.path.dirname(yara_rule_path).split("/")[-1]
+
+
 @shared_task
 def import_yara_rules(yara_rules_root_directory: str, import_id: int) -> None:
+    """
+    Import every YARA rule file in a directory, fanning the files out across workers in chunks.
+    """
     yara_rule_paths = [
         rule
         for rule in list_files_recursive(yara_rules_root_directory)
         if rule.endswith(".yar") or rule.endswith(".yara")
     ]
-    for rule_path in yara_rule_paths:
-        rules = parse_yara_rules_from_path(rule_path)
-        for rule in rules:
-            search_index.index_yara_rule(
-                rule,
-                collection_name=os.path.dirname(rule_path).split("/")[-1],
-                import_id=import_id,
+    try:
+        import_job = ImportYaraRuleJob.objects.get(id=import_id)
+    except ImportYaraRuleJob.DoesNotExist:
+        return None
+    try:
+        # Create every collection up front, so parallel chunks of the same directory share one collection.
+        for collection_name in {get_import_collection_name(p) for p in yara_rule_paths}:
+            database.get_or_create_import_collection(import_job, collection_name)
+
+        chunk_size = config.YARA_IMPORT_FILES_PER_TASK
+        chord(
+            import_yara_rule_files.s(yara_rule_paths[i : i + chunk_size], import_id)
+            for i in range(0, len(yara_rule_paths), chunk_size)
+        )(
+            finalize_yara_rules_import.s(import_id).on_error(
+                fail_yara_rules_import.s(import_id)
             )
+        )
+    except Exception as e:
+        release_yara_rules_import(import_id, error=str(e))
+        raise
+
+
+@shared_task
+def import_yara_rule_files(yara_rule_paths: typing.List[str], import_id: int) -> int:
+    """
+    Parse a chunk of YARA rule files belonging to an import, and write them to the database and search backend in
+    bulk, one collection (directory) at a time. The rules of a collection are streamed to the bulk writer file by
+    file, so only one file's rules are held in memory at once.
+
+    Returns: The number of rules processed.
+    """
+    rule_paths_by_collection = {}
+    for rule_path in yara_rule_paths:
+        rule_paths_by_collection.setdefault(
+            get_import_collection_name(rule_path), []
+        ).append(rule_path)
+    indexed_rule_files = []
+
+    def iter_parsed_rules(rule_paths: typing.List[str]) -> typing.Iterator[dict]:
+        for rule_path in rule_paths:
+            indexed_rule_file = read_indexed_rule_file(rule_path, lazy=True)
+            if not indexed_rule_file:
+                continue
+            parsed_rules = indexed_rule_file.pop("rules")
+            indexed_rule_file["rule_ids"] = []
+            indexed_rule_files.append(indexed_rule_file)
+            for parsed_rule in parsed_rules:
+                indexed_rule_file["rule_ids"].append(parsed_rule["rule_id"])
+                yield parsed_rule
+
+    indexed = 0
+    for collection_name, rule_paths in rule_paths_by_collection.items():
+        indexed += search_index.bulk_index_imported_yara_rules(
+            iter_parsed_rules(rule_paths),
+            collection_name=collection_name,
+            import_id=import_id,
+        )
+    # The inotify rule indexer takes the files over once the import is finalized.
+    record_indexed_rule_files(indexed_rule_files)
+    return indexed
+
+
+def release_yara_rules_import(import_id: int, error: str = "") -> None:
+    """
+    Hand the files of an import over to the inotify rule indexer, and refresh the artifacts of its collections.
+
+    Args:
+        import_id: The ID of the import job.
+        error: Why the import failed, if it did.
+    """
+    collection_ids = list(
+        YaraRuleCollection.objects.filter(import_job__id=import_id).values_list(
+            "id", flat=True
+        )
+    )
+    compiler.invalidate_compiled_rules(collection_ids=collection_ids)
+    ImportYaraRuleJob.objects.filter(id=import_id).update(importing=False, error=error)
+    for collection_id in collection_ids:
+        schedule_yara_rule_collection_artifacts(collection_id)
+
+
+@shared_task
+def finalize_yara_rules_import(indexed_counts: typing.List[int], import_id: int) -> int:
+    """
+    Run once every chunk of an import has finished.
+
+    Returns: The total number of rules processed.
+    """
+    release_yara_rules_import(import_id)
+    print(f"Import {import_id} processed {sum(indexed_counts)} rules.")
+    return sum(indexed_counts)
+
+
+@shared_task
+def fail_yara_rules_import(request, exc, traceback, import_id: int) -> None:
+    """
+    Run instead of finalize_yara_rules_import when a chunk of an import fails. The rules imported so far are kept.
+    """
+    print(f"Import {import_id} failed: {exc}")
+    release_yara_rules_import(import_id, error=str(exc))
@@ -10,10 +10,14 @@ from apps.rules.models import YaraRule, YaraRuleCollection
 from .serializers import (
     TestBinarySerializer,
     ScanBinaryRequest,
+    ScanBinaryBatchRequest,
     ScanBinaryLookupRequest,
+    ScanJobLookupRequest,
+    ScanJobSerializer,
+    YaraRuleMatchSerializer,
 )
-from .models import TestBinary
-from .tasks import match_yara_rules
+from .models import ScanJob, TestBinary, YaraRuleMatch
+from .tasks import match_yara_rules, match_yara_rules_batch
 
 
 class CreateUploadBinaryResource(CreateAPIView):
@@ -25,8 +29,15 @@ class CreateUploadBinaryResource(CreateAPIView):
     parser_classes = [MultiPartParser]
 
     def create(self, request, *args, **kwargs):
+        uploaded_file = request.data.get("file")
         alphanumeric_filename = re.sub(
-            r"[^a-zA-Z0-9.]", "_", request.data["file"].name
+            r"[^a-zA-Z0-9.]",
+            "_",
+            (
+                uploaded_file.name
+                if uploaded_file
+                else request.data.get("name") or request.data.get("sha256", "")
+            ),
         ).lower()
         serializer = self.get_serializer(data=request.data)
         user = serializer.context["request"].user
@@ -55,13 +66,90 @@ class ScanUploadBinaryResource(APIView):
         serializer.is_valid(raise_exception=True)
         rule_ids = serializer.validated_data.get("rule_ids", [])
         collection_ids = serializer.validated_data.get("collection_ids", [])
-        matches = match_yara_rules.delay(
+        scan_job = ScanJob.objects.create(
+            user=request.user, windowed=serializer.validated_data["windowed"]
+        )
+        match_yara_rules.delay(
             binary_id,
             rule_ids=rule_ids,
             collection_ids=collection_ids,
             user_id=request.user.id,
+            scan_job_id=scan_job.id,
+            fast=serializer.validated_data["fast"],
+            timeout=serializer.validated_data.get("timeout"),
+            windowed=serializer.validated_data["windowed"],
+        )
+        return Response(
+            status=status.HTTP_201_CREATED,
+            data={"scan_id": scan_job.id},
+        )
+
+
+class ScanUploadBinaryBatchResource(APIView):
+    """
+    A view to scan many test binaries with the same set of rules.
+    """
+
+    def post(self, request, *args, **kwargs):
+        """
+        Given a json payload containing a list of binary_ids (or all_binaries) and an array of rule_ids and
+        collection_ids, compile the rules once and run them against every binary.
+        """
+        serializer = ScanBinaryBatchRequest(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        scan_job = ScanJob.objects.create(
+            user=request.user, windowed=serializer.validated_data["windowed"]
+        )
+        match_yara_rules_batch.delay(
+            serializer.validated_data.get("binary_ids", []),
+            rule_ids=serializer.validated_data.get("rule_ids", []),
+            collection_ids=serializer.validated_data.get("collection_ids", []),
+            user_id=request.user.id,
+            all_binaries=serializer.validated_data["all_binaries"],
+            scan_job_id=scan_job.id,
+            fast=serializer.validated_data["fast"],
+            timeout=serializer.validated_data.get("timeout"),
+            windowed=serializer.validated_data["windowed"],
         )
         return Response(
             status=status.HTTP_201_CREATED,
-            data={},
+            data={"scan_id": scan_job.id},
+        )
+
+
+class ScanJobResource(APIView):
+    """
+    A view to poll the progress and results of a scan job.
+    """
+
+    def get(self, request, *args, **kwargs):
+        """
+        Return the status of a scan job along with the matches recorded after the "since" match id.
+        Clients poll with the returned "next" cursor to receive results as each binary finishes.
+        """
+        serializer = ScanJobLookupRequest(
+            data={**request.query_params.dict(), **kwargs}
+        )
+        serializer.is_valid(raise_exception=True)
+        scan_job = ScanJob.objects.filter(
+            id=serializer.validated_data["scan_id"], user=request.user
+        ).first()
+        if not scan_job:
+            return Response(
+                {"error": "Scan not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        since = serializer.validated_data["since"]
+        yara_rule_matches = (
+            YaraRuleMatch.objects.filter(scan_job=scan_job, id__gt=since)
+            .select_related("rule", "test_binary")
+            .order_by("id")[: serializer.validated_data["max_results"]]
+        )
+        matches = YaraRuleMatchSerializer(yara_rule_matches, many=True).data
+        return Response(
+            {
+                "scan": ScanJobSerializer(scan_job).data,
+                "matches": matches,
+                "next": matches[-1]["id"] if matches else since,
+            },
+            status=status.HTTP_200_OK,
         )
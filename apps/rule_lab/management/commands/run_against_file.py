@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
 
-from apps.rule_lab.models import TestBinary
+from apps.rule_lab.models import TestBinary, YaraRuleMatch
 from apps.rule_lab.tasks import match_yara_rules
 
 
@@ -15,12 +15,13 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             "--collection_ids",
-            type=str,
+            type=int,
             help="A list of collection_ids to run against the file.",
+            nargs="+",
         )
         parser.add_argument(
             "--rule_ids",
-            type=str,
+            type=int,
             help="A list of rule_ids to run against the file.",
             nargs="+",
         )
@@ -38,11 +39,13 @@ class Command(BaseCommand):
         if not test_binary:
             return None
 
-        print(
-            match_yara_rules(
-                user=user,
-                test_binary_file=test_binary,
-                rule_ids=options.get("rule_ids"),
-                collection_ids=options.get("collection_ids"),
-            )
+        scan_job_id = match_yara_rules(
+            test_binary.binary_id,
+            rule_ids=options.get("rule_ids") or [],
+            collection_ids=options.get("collection_ids") or [],
+            user_id=user.id,
         )
+        for yara_rule_match in YaraRuleMatch.objects.filter(
+            scan_job__id=scan_job_id
+        ).select_related("rule"):
+            print(yara_rule_match.rule.rule_id, yara_rule_match.strings)
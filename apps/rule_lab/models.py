@@ -1,16 +1,85 @@
-import re
+import os
 import hashlib
-from django.db import models
+import tempfile
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from yarawesome.settings import MEDIA_ROOT
 from apps.rules.models import YaraRule
 
 
+def binary_blob_path(sha256: str) -> str:
+    """
+    Return the path, relative to MEDIA_ROOT, of the content-addressed blob with the given SHA-256.
+    """
+    return f"binaries/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
 def user_binaries_directory_path(instance, filename):
     """
     Return the path to a user's test binary.
     """
-    partial_hash = hashlib.md5(instance.file.read(4096)).hexdigest()
-    return f"test_binaries/{instance.user.id}/{partial_hash}"
+    return binary_blob_path(instance.blob_id)
+
+
+class BinaryBlob(models.Model):
+    """
+    A model to represent the stored contents of a test binary, shared by every upload of the same file.
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    md5 = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    reference_count = models.IntegerField(default=0)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def path(self) -> str:
+        return binary_blob_path(self.sha256)
+
+    def __str__(self):
+        return f"BinaryBlob {self.sha256}"
+
+
+def store_binary_blob(uploaded_file) -> BinaryBlob:
+    """
+    Stream an uploaded file into the content-addressed store, hashing it in the same pass.
+
+    The blob is locked until the surrounding transaction ends, so a reference to it can be taken before it is
+    released; the file is moved into place once the transaction commits.
+
+    Args:
+        uploaded_file: The uploaded file.
+
+    Returns: The BinaryBlob holding the file's contents; an existing blob if the file is already stored.
+    """
+    blobs_directory = os.path.join(MEDIA_ROOT, "binaries")
+    os.makedirs(blobs_directory, exist_ok=True)
+    md5_hash = hashlib.md5()
+    sha256_hash = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=blobs_directory, delete=False) as temp_out:
+        for chunk in uploaded_file.chunks():
+            md5_hash.update(chunk)
+            sha256_hash.update(chunk)
+            size += len(chunk)
+            temp_out.write(chunk)
+    sha256 = sha256_hash.hexdigest()
+    blob_path = os.path.join(MEDIA_ROOT, binary_blob_path(sha256))
+
+    def move_into_place():
+        # Also restores the file of a blob released while this one was being stored; the contents are identical.
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(temp_out.name, blob_path)
+
+    with transaction.atomic():
+        binary_blob, _ = BinaryBlob.objects.select_for_update().get_or_create(
+            sha256=sha256, defaults={"md5": md5_hash.hexdigest(), "size": size}
+        )
+        transaction.on_commit(move_into_place)
+    return binary_blob
 
 
 class TestBinary(models.Model):
@@ -19,26 +88,95 @@ class TestBinary(models.Model):
     """
 
     id = models.AutoField(primary_key=True)
-    binary_id = models.CharField(
-        max_length=32, unique=True, blank=True, null=True, editable=False
-    )
+    binary_id = models.CharField(max_length=32, blank=True, null=True, editable=False)
     name = models.CharField(max_length=255)
     created_time = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    blob = models.ForeignKey(BinaryBlob, on_delete=models.PROTECT, null=True)
     file = models.FileField(upload_to=user_binaries_directory_path)
 
+    class Meta:
+        # A user only needs one copy of a given binary.
+        unique_together = ("user", "binary_id")
+
     def __str__(self):
         return f"TestBinary {self.id} by {self.user.username}"
 
     def save(self, *args, **kwargs):
-        # Calculate MD5 hash of the file's contents
-        if not self.binary_id:
-            md5_hash = hashlib.md5()
-            for chunk in self.file.chunks():
-                md5_hash.update(chunk)
-            self.binary_id = md5_hash.hexdigest()
+        adding = self._state.adding
+        with transaction.atomic():
+            # Newly uploaded contents are moved into the content-addressed store.
+            if not self.blob_id and self.file and not self.file._committed:
+                self.blob = store_binary_blob(self.file)
+                self.file = self.blob.path
+            if not self.binary_id and self.blob_id:
+                self.binary_id = self.blob.md5
+            if adding and self.blob_id:
+                # Updating the blob locks it, so it cannot be released before the test binary is saved.
+                if not BinaryBlob.objects.filter(sha256=self.blob_id).update(
+                    reference_count=F("reference_count") + 1
+                ):
+                    raise BinaryBlob.DoesNotExist(f"{self.blob_id} has been released.")
+            super(TestBinary, self).save(*args, **kwargs)
+
+
+@receiver(post_delete, sender=TestBinary)
+def release_binary_blob(sender, instance, **kwargs):
+    """
+    Drop a reference to a test binary's blob, removing the blob once nothing refers to it.
+    """
+    if not instance.blob_id:
+        return
+    sha256 = instance.blob_id
+
+    def remove_blob_file():
+        # The blob may have been stored again since it was deleted.
+        if BinaryBlob.objects.filter(sha256=sha256).exists():
+            return
+        try:
+            os.remove(os.path.join(MEDIA_ROOT, binary_blob_path(sha256)))
+        except FileNotFoundError:
+            pass
+
+    with transaction.atomic():
+        if not BinaryBlob.objects.select_for_update().filter(sha256=sha256).first():
+            return
+        BinaryBlob.objects.filter(sha256=sha256).update(
+            reference_count=F("reference_count") - 1
+        )
+        if BinaryBlob.objects.filter(sha256=sha256, reference_count__lte=0).delete()[0]:
+            transaction.on_commit(remove_blob_file)
+
 
-        super(TestBinary, self).save(*args, **kwargs)
+class ScanJob(models.Model):
+    """
+    A model to represent a scan of one or more test binaries.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (COMPLETED, "Completed"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    completed_time = models.DateTimeField(blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    binaries_total = models.IntegerField(default=0)
+    binaries_scanned = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    # Large binaries are scanned in windows, which changes the semantics of conditions that depend on the whole file.
+    windowed = models.BooleanField(default=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"ScanJob {self.id} by {self.user.username}"
 
 
 class YaraRuleMatch(models.Model):
@@ -50,6 +188,11 @@ class YaraRuleMatch(models.Model):
     created_time = models.DateTimeField(auto_now_add=True)
     rule = models.ForeignKey(YaraRule, on_delete=models.CASCADE)
     test_binary = models.ForeignKey(TestBinary, on_delete=models.CASCADE)
+    scan_job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, null=True)
+    # A list of {"identifier": ..., "offset": ..., "length": ...} string matches.
+    strings = models.JSONField(default=list)
+    # Whether the binary was scanned in windows; the conditions of the rule were evaluated per window.
+    windowed = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
     def __str__(self):
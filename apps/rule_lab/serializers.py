@@ -1,11 +1,64 @@
+from django.db import transaction
 from rest_framework import serializers
-from apps.rule_lab.models import TestBinary
+from apps.rule_lab.models import (
+    ScanJob,
+    TestBinary,
+    YaraRuleMatch,
+    store_binary_blob,
+)
 
 
 class TestBinarySerializer(serializers.ModelSerializer):
+    # Uploading only the SHA-256 of a binary the user already uploaded skips the file transfer entirely. Binaries
+    # of other users must be uploaded again, so their existence is never revealed; they are stored once regardless.
+    sha256 = serializers.CharField(min_length=64, max_length=64, required=False)
+
     class Meta:
         model = TestBinary
-        fields = ["file"]
+        fields = ["file", "sha256", "binary_id"]
+        extra_kwargs = {"file": {"required": False}}
+
+    def validate(self, data):
+        if not data.get("file") and not data.get("sha256"):
+            raise serializers.ValidationError("Either file or sha256 must be provided.")
+        if not data.get("file"):
+            data["sha256"] = data["sha256"].lower()
+            if not TestBinary.objects.filter(
+                user=self.context["request"].user, blob_id=data["sha256"]
+            ).exists():
+                raise serializers.ValidationError(
+                    "Unknown sha256, the file must be uploaded."
+                )
+        return data
+
+    def create(self, validated_data):
+        uploaded_file = validated_data.pop("file", None)
+        sha256 = validated_data.pop("sha256", None)
+        if not uploaded_file:
+            test_binary = TestBinary.objects.filter(
+                user=validated_data["user"], blob_id=sha256
+            ).first()
+            if not test_binary:
+                raise serializers.ValidationError(
+                    "Unknown sha256, the file must be uploaded."
+                )
+            return test_binary
+        # The blob stays locked until the test binary referring to it is saved.
+        with transaction.atomic():
+            binary_blob = store_binary_blob(uploaded_file)
+            test_binary = TestBinary.objects.filter(
+                user=validated_data["user"], binary_id=binary_blob.md5
+            ).first()
+            if test_binary:
+                return test_binary
+            return TestBinary.objects.create(
+                blob=binary_blob, file=binary_blob.path, **validated_data
+            )
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation["sha256"] = instance.blob_id
+        return representation
 
 
 class ScanBinaryRequest(serializers.Serializer):
@@ -15,6 +68,9 @@ class ScanBinaryRequest(serializers.Serializer):
     collection_ids = serializers.ListField(
         child=serializers.IntegerField(min_value=1), required=False
     )
+    fast = serializers.BooleanField(default=False)
+    timeout = serializers.IntegerField(min_value=1, required=False)
+    windowed = serializers.BooleanField(default=False)
 
     def validate(self, data):
         rule_ids = data.get("rule_ids")
@@ -29,3 +85,48 @@ class ScanBinaryRequest(serializers.Serializer):
 
 class ScanBinaryLookupRequest(serializers.Serializer):
     binary_id = serializers.CharField(max_length=32)
+
+
+class ScanBinaryBatchRequest(ScanBinaryRequest):
+    binary_ids = serializers.ListField(
+        child=serializers.CharField(max_length=32), required=False
+    )
+    all_binaries = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        data = super().validate(data)
+        if not data.get("binary_ids") and not data.get("all_binaries"):
+            raise serializers.ValidationError(
+                "Either binary_ids or all_binaries must be provided."
+            )
+        return data
+
+
+class ScanJobLookupRequest(serializers.Serializer):
+    scan_id = serializers.IntegerField(min_value=1)
+    since = serializers.IntegerField(min_value=0, default=0)
+    max_results = serializers.IntegerField(min_value=1, max_value=1000, default=500)
+
+
+class ScanJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScanJob
+        fields = [
+            "id",
+            "status",
+            "created_time",
+            "completed_time",
+            "binaries_total",
+            "binaries_scanned",
+            "error",
+            "windowed",
+        ]
+
+
+class YaraRuleMatchSerializer(serializers.ModelSerializer):
+    rule_id = serializers.CharField(source="rule.rule_id")
+    binary_id = serializers.CharField(source="test_binary.binary_id")
+
+    class Meta:
+        model = YaraRuleMatch
+        fields = ["id", "rule_id", "binary_id", "strings", "windowed", "created_time"]
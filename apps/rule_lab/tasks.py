@@ -1,14 +1,281 @@
+import mmap
 import os
-import shutil
-import tempfile
 import typing
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
 
 import yara
 from celery import shared_task
 from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import F, QuerySet
+from django.utils import timezone
+from yarawesome import config
 from yarawesome.settings import MEDIA_ROOT
+from yarawesome.utils import compiler
 from apps.rules.models import YaraRule
-from .models import TestBinary, YaraRuleMatch
+from .models import ScanJob, TestBinary, YaraRuleMatch
+
+
+def get_yara_rules_to_match(
+    user: User, rule_ids: typing.List[int], collection_ids: typing.List[int]
+) -> QuerySet:
+    """
+    Select the rules to run against one or more binaries.
+
+    Args:
+        user: The user running the scan.
+        rule_ids: The ids of individual rules to run.
+        collection_ids: The ids of the user's collections to run.
+
+    Returns: A queryset of YaraRule instances.
+    """
+    yara_rules = YaraRule.objects.none()
+    if rule_ids:
+        yara_rules |= YaraRule.objects.filter(id__in=rule_ids)
+    if collection_ids:
+        yara_rules |= YaraRule.objects.filter(
+            collection_id__in=collection_ids, user=user
+        )
+    return yara_rules
+
+
+def merge_yara_matches(
+    matches: typing.List[yara.Match],
+    merged_matches: typing.Dict[int, dict],
+    rule_ids_by_name: typing.Dict[typing.Tuple[str, str], list],
+    base_offset: int = 0,
+) -> typing.Dict[int, dict]:
+    """
+    Merge the matches of a (partial) scan into a mapping of rule id to string matches.
+
+    Args:
+        matches: The matches returned by yara.Rules.match.
+        merged_matches: The mapping to merge into; {rule id: {(identifier, offset): length}}.
+        rule_ids_by_name: The mapping of {(namespace, rule name): [rule id, ...]} returned by compile_yara_rules.
+        base_offset: The offset of the scanned data within the binary.
+
+    Returns: The updated mapping. String matches found twice in overlapping windows are only kept once.
+    """
+    for match in matches:
+        for rule_id in rule_ids_by_name.get((match.namespace, match.rule), []):
+            string_matches = merged_matches.setdefault(rule_id, {})
+            for string_match in match.strings:
+                for instance in string_match.instances:
+                    string_matches[
+                        (string_match.identifier, base_offset + instance.offset)
+                    ] = instance.matched_length
+    return merged_matches
+
+
+def match_binary_file(
+    compiled_rules: yara.Rules,
+    rule_ids_by_name: typing.Dict[typing.Tuple[str, str], list],
+    binary_file_path: str,
+    fast: bool = False,
+    timeout: typing.Optional[int] = None,
+    executor: typing.Optional[Executor] = None,
+    windowed: bool = False,
+) -> typing.Dict[int, dict]:
+    """
+    Match a compiled ruleset against a binary file without reading it into memory.
+
+    The file is memory-mapped and matched as a whole. When windowed, files larger than YARA_SCAN_WINDOW_SIZE are
+    instead scanned in windows overlapping by YARA_SCAN_WINDOW_OVERLAP bytes, on the executor if one is given, and
+    their string offsets merged. Conditions are then evaluated per window, so those depending on the whole file
+    (e.g. filesize, uint16(0), string counts, absent strings, or strings further apart than the overlap) may
+    match differently.
+
+    Args:
+        compiled_rules: The compiled ruleset.
+        rule_ids_by_name: The mapping of {(namespace, rule name): [rule id, ...]} returned by compile_yara_rules.
+        binary_file_path: The path to the binary.
+        fast: Stop at the first occurrence of each string.
+        timeout: The maximum number of seconds to spend on the file, or on each window.
+        executor: The executor to scan the windows on; they are scanned one after the other without one. Must not
+        be the executor this function itself runs on.
+        windowed: Scan files larger than YARA_SCAN_WINDOW_SIZE in windows.
+
+    Returns: A mapping of {rule id: {(identifier, offset): length}}.
+    """
+    timeout = timeout or config.YARA_SCAN_TIMEOUT
+    merged_matches = {}
+    with open(binary_file_path, "rb") as binary_in:
+        file_size = os.fstat(binary_in.fileno()).st_size
+        if not file_size:
+            return merge_yara_matches(
+                compiled_rules.match(data=b"", fast=fast, timeout=timeout),
+                merged_matches,
+                rule_ids_by_name,
+            )
+        with mmap.mmap(binary_in.fileno(), 0, access=mmap.ACCESS_READ) as binary_map:
+            binary_view = memoryview(binary_map)
+            try:
+                window_size = config.YARA_SCAN_WINDOW_SIZE if windowed else file_size
+                window_starts = range(0, file_size, window_size)
+
+                def _match_window(start: int):
+                    end = min(
+                        start + window_size + config.YARA_SCAN_WINDOW_OVERLAP, file_size
+                    )
+                    return start, compiled_rules.match(
+                        data=binary_view[start:end], fast=fast, timeout=timeout
+                    )
+
+                if executor and len(window_starts) > 1:
+                    results = list(executor.map(_match_window, window_starts))
+                else:
+                    results = [_match_window(start) for start in window_starts]
+                for start, matches in results:
+                    merge_yara_matches(
+                        matches, merged_matches, rule_ids_by_name, base_offset=start
+                    )
+            finally:
+                binary_view.release()
+    return merged_matches
+
+
+def build_yara_rule_matches(
+    merged_matches: typing.Dict[int, dict],
+    test_binary: TestBinary,
+    user: User,
+    scan_job: typing.Optional[ScanJob] = None,
+    windowed: bool = False,
+) -> typing.List[YaraRuleMatch]:
+    """
+    Convert the merged matches of a binary into (unsaved) YaraRuleMatch instances.
+
+    Args:
+        merged_matches: The mapping returned by match_binary_file.
+        test_binary: The binary that was scanned.
+        user: The user running the scan.
+        scan_job: The scan job the matches belong to.
+        windowed: Whether the binary was scanned in windows.
+
+    Returns: A list of YaraRuleMatch instances, one per matching rule.
+    """
+    return [
+        YaraRuleMatch(
+            rule_id=rule_id,
+            test_binary=test_binary,
+            scan_job=scan_job,
+            user=user,
+            windowed=windowed,
+            strings=[
+                {"identifier": identifier, "offset": offset, "length": length}
+                for (identifier, offset), length in sorted(
+                    string_matches.items(), key=lambda item: item[0][1]
+                )
+            ],
+        )
+        for rule_id, string_matches in merged_matches.items()
+    ]
+
+
+def fail_scan_job(scan_job_id: int, error: str) -> None:
+    """
+    Mark a scan job as failed.
+
+    Args:
+        scan_job_id: The id of the scan job.
+        error: The reason the scan failed.
+    """
+    ScanJob.objects.filter(id=scan_job_id).update(
+        status=ScanJob.FAILED, error=error, completed_time=timezone.now()
+    )
+
+
+def run_scan_job(
+    scan_job: ScanJob,
+    test_binaries: typing.List[TestBinary],
+    yara_rules: QuerySet,
+    fast: bool = False,
+    timeout: typing.Optional[int] = None,
+    windowed: bool = False,
+) -> ScanJob:
+    """
+    Compile a set of rules once and match them against each binary, persisting the matches of every binary as soon
+    as it has been scanned.
+
+    yara-python releases the GIL while scanning, so the binaries are matched on a thread pool sharing a single
+    compiled ruleset. A single large binary of a windowed scan is split into windows on the same pool instead.
+
+    Args:
+        scan_job: The scan job to record progress and results against.
+        test_binaries: The binaries to scan.
+        yara_rules: The rules to run.
+        fast: Stop at the first occurrence of each string.
+        timeout: The maximum number of seconds to spend scanning each binary (or window of a large binary).
+        windowed: Scan binaries larger than YARA_SCAN_WINDOW_SIZE in windows; their matches are flagged as such.
+
+    Returns: The completed scan job.
+    """
+    ScanJob.objects.filter(id=scan_job.id).update(
+        status=ScanJob.RUNNING, binaries_total=len(test_binaries)
+    )
+    try:
+        _, compiled_rules, rule_ids_by_name = compiler.compile_yara_rules(yara_rules)
+    except yara.Error as e:
+        fail_scan_job(scan_job.id, str(e))
+        scan_job.refresh_from_db()
+        return scan_job
+
+    def _get_binary_path(test_binary: TestBinary) -> str:
+        return os.path.join(MEDIA_ROOT, test_binary.file.name)
+
+    def _match(test_binary: TestBinary, executor: typing.Optional[Executor] = None):
+        return match_binary_file(
+            compiled_rules,
+            rule_ids_by_name,
+            _get_binary_path(test_binary),
+            fast=fast,
+            timeout=timeout,
+            executor=executor,
+            windowed=windowed,
+        )
+
+    errors = []
+
+    def _record(test_binary: TestBinary, get_merged_matches: typing.Callable):
+        try:
+            YaraRuleMatch.objects.bulk_create(
+                build_yara_rule_matches(
+                    get_merged_matches(),
+                    test_binary,
+                    scan_job.user,
+                    scan_job,
+                    windowed=windowed
+                    and os.path.getsize(_get_binary_path(test_binary))
+                    > config.YARA_SCAN_WINDOW_SIZE,
+                ),
+                batch_size=500,
+            )
+        except (yara.Error, OSError) as e:
+            # A binary that times out or cannot be read should not fail the rest of the scan.
+            errors.append(f"{test_binary.binary_id}: {e}")
+        ScanJob.objects.filter(id=scan_job.id).update(
+            binaries_scanned=F("binaries_scanned") + 1
+        )
+
+    with ThreadPoolExecutor(max_workers=config.YARA_SCAN_WORKERS) as executor:
+        if len(test_binaries) == 1:
+            # Matched from this thread rather than a pool worker, so the windows can use the pool.
+            _record(
+                test_binaries[0], lambda: _match(test_binaries[0], executor=executor)
+            )
+        else:
+            futures = {
+                executor.submit(_match, test_binary): test_binary
+                for test_binary in test_binaries
+            }
+            for future in as_completed(futures):
+                _record(futures[future], future.result)
+    ScanJob.objects.filter(id=scan_job.id).update(
+        status=ScanJob.COMPLETED,
+        error="\n".join(errors),
+        completed_time=timezone.now(),
+    )
+    scan_job.refresh_from_db()
+    return scan_job
 
 
 @shared_task
@@ -17,23 +284,78 @@ def match_yara_rules(
     rule_ids: typing.List[int],
     collection_ids: typing.List[int],
     user_id: int,
-) -> None:
+    scan_job_id: typing.Optional[int] = None,
+    fast: bool = False,
+    timeout: typing.Optional[int] = None,
+    windowed: bool = False,
+) -> int:
     """
     Match a set of rules to a binary file.
+
+    Returns: The id of the scan job holding the matches.
     """
-    user = User.objects.get(id=user_id)
-    test_binary_file = TestBinary.objects.get(binary_id=binary_id)
-    # Create a temporary file to store rule contents
+    try:
+        user = User.objects.get(id=user_id)
+        test_binary_file = TestBinary.objects.get(binary_id=binary_id, user=user)
+    except ObjectDoesNotExist as e:
+        # The binary may have been deleted while the scan was queued.
+        if scan_job_id:
+            fail_scan_job(scan_job_id, str(e))
+        raise
     print(f"Matching rules to {test_binary_file}")
-    binary_file_path = os.path.join(MEDIA_ROOT, test_binary_file.file.name)
-    temp_file = tempfile.NamedTemporaryFile(delete=False, mode="a")
-    if rule_ids:
-        for rule in YaraRule.objects.filter(id__in=rule_ids):
-            temp_file.write(rule.content + "\n\n")
-    if collection_ids:
-        for collection_id in collection_ids:
-            for rule in YaraRule.objects.filter(collection_id=collection_id, user=user):
-                temp_file.write(rule.content + "\n\n")
-    compiled_rules = yara.compile(filepath=temp_file.name)
-    matches = compiled_rules.match(binary_file_path)
-    return matches
+    if scan_job_id:
+        scan_job = ScanJob.objects.get(id=scan_job_id)
+    else:
+        scan_job = ScanJob.objects.create(user=user, windowed=windowed)
+    run_scan_job(
+        scan_job,
+        [test_binary_file],
+        get_yara_rules_to_match(user, rule_ids, collection_ids),
+        fast=fast,
+        timeout=timeout,
+        windowed=windowed,
+    )
+    return scan_job.id
+
+
+@shared_task
+def match_yara_rules_batch(
+    binary_ids: typing.List[str],
+    rule_ids: typing.List[int],
+    collection_ids: typing.List[int],
+    user_id: int,
+    all_binaries: bool = False,
+    scan_job_id: typing.Optional[int] = None,
+    fast: bool = False,
+    timeout: typing.Optional[int] = None,
+    windowed: bool = False,
+) -> int:
+    """
+    Match a set of rules to many binary files, compiling the rules only once.
+
+    Returns: The id of the scan job holding the matches.
+    """
+    try:
+        user = User.objects.get(id=user_id)
+    except ObjectDoesNotExist as e:
+        if scan_job_id:
+            fail_scan_job(scan_job_id, str(e))
+        raise
+    test_binaries = TestBinary.objects.filter(user=user)
+    if not all_binaries:
+        test_binaries = test_binaries.filter(binary_id__in=binary_ids)
+    test_binaries = list(test_binaries)
+    print(f"Matching rules to {len(test_binaries)} binaries")
+    if scan_job_id:
+        scan_job = ScanJob.objects.get(id=scan_job_id)
+    else:
+        scan_job = ScanJob.objects.create(user=user, windowed=windowed)
+    run_scan_job(
+        scan_job,
+        test_binaries,
+        get_yara_rules_to_match(user, rule_ids, collection_ids),
+        fast=fast,
+        timeout=timeout,
+        windowed=windowed,
+    )
+    return scan_job.id
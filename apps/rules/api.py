@@ -19,31 +19,23 @@ class RuleSearchResource(APIView):
         term = serializer.validated_data["term"]
         start = serializer.validated_data["start"]
         max_results = serializer.validated_data["max_results"]
+        cursor = serializer.validated_data.get("cursor")
         if self.public:
-            response = search_index.search_yara_rules_index(
-                term, start, max_results, user=None
+            status_code, search_results = search_index.search_public_yara_rules(
+                term, start, max_results, cursor=cursor
             )
         else:
             response = search_index.search_yara_rules_index(
-                term, start, max_results, user=request.user
+                term, start, max_results, user=request.user, cursor=cursor
             )
-        if response.status_code == 200:
-            if self.public:
-                return Response(
-                    search_index.contextualize_yara_rules_search_response(
-                        response, term, start, max_results, user=None
-                    ),
-                    status=status.HTTP_200_OK,
-                )
-            else:
-                return Response(
-                    search_index.contextualize_yara_rules_search_response(
-                        response, term, start, max_results, user=request.user
-                    ),
-                    status=status.HTTP_200_OK,
+            status_code, search_results = response.status_code, None
+            if response.status_code == 200:
+                search_results = search_index.contextualize_yara_rules_search_response(
+                    response, term, start, max_results, user=request.user, cursor=cursor
                 )
-
-        elif response.status_code == 401:
+        if status_code == 200:
+            return Response(search_results, status=status.HTTP_200_OK)
+        elif status_code == 401:
             return Response(
                 {"error": "Could not authenticate to search backend."},
                 status=status.HTTP_401_UNAUTHORIZED,
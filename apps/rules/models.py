@@ -1,18 +1,118 @@
+import hashlib
+import typing
+import zlib
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from yarawesome import config
 from apps.rule_import.models import ImportYaraRuleJob
 from apps.rule_collections.models import YaraRuleCollection
 
 
+def get_yara_rule_body_hash(content: str) -> str:
+    """
+    Return the SHA-256 a rule body is stored under.
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class YaraRuleBody(models.Model):
+    """
+    A model to represent the content of a YARA rule, shared by every rule with the same content.
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+    # The rule as parsed by plyara, stored once alongside the content it was parsed from.
+    parsed = models.JSONField(blank=True, null=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    # Touched whenever a rule is about to refer to the body; unreferenced bodies are only deleted after a grace period.
+    last_referenced_time = models.DateTimeField(default=timezone.now)
+
+    @property
+    def content(self) -> str:
+        data = bytes(self.data)
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def __str__(self):
+        return f"YaraRuleBody {self.sha256}"
+
+
+def make_yara_rule_body(
+    content: str, parsed: typing.Optional[dict] = None
+) -> YaraRuleBody:
+    """
+    Build an (unsaved) YaraRuleBody, compressing contents of at least YARA_RULE_BODY_COMPRESSION_THRESHOLD bytes.
+    """
+    data = content.encode("utf-8")
+    compressed = False
+    if len(data) >= config.YARA_RULE_BODY_COMPRESSION_THRESHOLD:
+        compressed_data = zlib.compress(data)
+        if len(compressed_data) < len(data):
+            data, compressed = compressed_data, True
+    return YaraRuleBody(
+        sha256=get_yara_rule_body_hash(content),
+        data=data,
+        compressed=compressed,
+        parsed=parsed,
+    )
+
+
+def store_yara_rule_bodies(
+    contents: typing.Iterable[str],
+    parsed_rules: typing.Optional[typing.Iterable[typing.Optional[dict]]] = None,
+) -> typing.List[str]:
+    """
+    Store rule contents in the content-addressed store; contents that are already stored are not written again.
+
+    Args:
+        contents: The contents of the rules.
+        parsed_rules: The plyara parse of each content, in order, to store with the contents that are new.
+
+    Returns: The SHA-256 of each content, in order.
+    """
+    contents = list(contents)
+    parsed_rules = list(parsed_rules) if parsed_rules else [None] * len(contents)
+    body_hashes = [get_yara_rule_body_hash(content) for content in contents]
+    contents_by_hash = dict(zip(body_hashes, zip(contents, parsed_rules)))
+    # Touch the bodies first, so the garbage collector no longer considers them, then create the missing ones.
+    YaraRuleBody.objects.filter(sha256__in=list(contents_by_hash)).update(
+        last_referenced_time=timezone.now()
+    )
+    stored = set(
+        YaraRuleBody.objects.filter(sha256__in=list(contents_by_hash)).values_list(
+            "sha256", flat=True
+        )
+    )
+    YaraRuleBody.objects.bulk_create(
+        [
+            make_yara_rule_body(content, parsed)
+            for body_hash, (content, parsed) in contents_by_hash.items()
+            if body_hash not in stored
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    return body_hashes
+
+
 class YaraRule(models.Model):
     """
     A model to represent a YARA rule.
     """
 
     id = models.AutoField(primary_key=True)
-    rule_id = models.CharField(max_length=32)
+    rule_id = models.CharField(max_length=32, db_index=True)
     public = models.BooleanField(default=False)
-    content = models.TextField()
+    # Stored once, however many users and collections have the rule.
+    body = models.ForeignKey(YaraRuleBody, on_delete=models.PROTECT)
+    # Parsed at write time, so pages and downloads never need to run plyara.
+    name = models.CharField(max_length=255, blank=True, default="")
+    description = models.TextField(blank=True, default="")
+    author = models.TextField(blank=True, default="")
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     import_job = models.ForeignKey(ImportYaraRuleJob, on_delete=models.CASCADE)
     collection = models.ForeignKey(
@@ -22,6 +122,21 @@ class YaraRule(models.Model):
     class Meta:
         # A user can only have one rule with a given rule_id
         unique_together = ("rule_id", "collection")
+        indexes = [models.Index(fields=["user", "rule_id"])]
+
+    @property
+    def content(self) -> str:
+        return self.body.content
+
+    def set_content(self, content: str, parsed: typing.Optional[dict] = None) -> None:
+        """
+        Point the rule at the stored body of a content, storing it first if it is new. The rule itself is not saved.
+
+        Args:
+            content: The content of the rule.
+            parsed: The rule as parsed by plyara, stored with the body if it is new.
+        """
+        self.body_id = store_yara_rule_bodies([content], [parsed])[0]
 
     def __str__(self):
         return self.id
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 
+from yarawesome.utils import search_index
+
 
 class RuleLookupSerializer(serializers.Serializer):
     rule_id = serializers.CharField(max_length=32)
@@ -9,3 +11,11 @@ class RuleSearchSerializer(serializers.Serializer):
     term = serializers.CharField(max_length=128, default="*")
     start = serializers.IntegerField(min_value=0, default=0)
     max_results = serializers.IntegerField(min_value=1, default=10)
+    cursor = serializers.CharField(max_length=1024, required=False)
+
+    def validate_cursor(self, value):
+        try:
+            search_index.decode_search_cursor(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
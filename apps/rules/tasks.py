@@ -0,0 +1,46 @@
+import typing
+
+from celery import shared_task
+from django.contrib.auth.models import User
+from yarawesome.utils import database, search_index
+
+
+@shared_task
+def reconcile_yara_rules_indexes() -> None:
+    """
+    Reconcile the public index, and every user's index, with the database; run periodically by Celery beat.
+    """
+    reconcile_yara_rules_index.delay(None)
+    for user_id in User.objects.values_list("id", flat=True).iterator():
+        reconcile_yara_rules_index.delay(user_id)
+
+
+@shared_task
+def reconcile_yara_rules_index(user_id: typing.Optional[int]) -> dict:
+    """
+    Reconcile a user's index, or the public index if no user is given, with the database.
+
+    Returns: The number of orphaned, missing and stray documents found.
+    """
+    user = None
+    if user_id:
+        user = User.objects.filter(id=user_id).first()
+        if not user:
+            return {}
+    drift = search_index.reconcile_yara_rules_index(user)
+    if any(drift.values()):
+        print(f"Reconciled {search_index.get_yara_rules_index_name(user)}: {drift}")
+    return drift
+
+
+@shared_task
+def delete_unreferenced_yara_rule_bodies() -> int:
+    """
+    Delete stored rule bodies no rule refers to any more; run periodically by Celery beat.
+
+    Returns: The number of bodies deleted.
+    """
+    deleted = database.delete_unreferenced_yara_rule_bodies()
+    if deleted:
+        print(f"Deleted {deleted} unreferenced rule bodies.")
+    return deleted
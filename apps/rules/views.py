@@ -1,9 +1,25 @@
+import typing
+
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect, render
 
 from yarawesome.utils import database, search_index
 
 
+def get_search_cursor(request) -> typing.Optional[str]:
+    """
+    Get the cursor to the requested page of search results, ignoring malformed cursors.
+    """
+    cursor = request.GET.get("cursor")
+    if not cursor:
+        return None
+    try:
+        search_index.decode_search_cursor(cursor)
+    except ValueError:
+        return None
+    return cursor
+
+
 @login_required
 def rule(request, rule_id: str):
     is_owner = False
@@ -28,12 +44,18 @@ def my_rules(request):
         term = "*"
     start = int(request.GET.get("start", 0))
     max_results = int(request.GET.get("max_results", 10))
+    cursor = get_search_cursor(request)
     response = search_index.search_yara_rules_index(
-        term, start, max_results, user=request.user
+        term, start, max_results, user=request.user, cursor=cursor
     )
     if response.status_code == 200:
         search_results = search_index.contextualize_yara_rules_search_response(
-            response, term=term, start=start, max_results=max_results, user=request.user
+            response,
+            term=term,
+            start=start,
+            max_results=max_results,
+            user=request.user,
+            cursor=cursor,
         )
     else:
         search_results = {
@@ -55,12 +77,10 @@ def shared_rules(request):
         term = "*"
     start = int(request.GET.get("start", 0))
     max_results = int(request.GET.get("max_results", 10))
-    response = search_index.search_yara_rules_index(term, start, max_results, user=None)
-    if response.status_code == 200:
-        search_results = search_index.contextualize_yara_rules_search_response(
-            response, term=term, start=start, max_results=max_results, user=None
-        )
-    else:
+    status_code, search_results = search_index.search_public_yara_rules(
+        term, start, max_results, cursor=get_search_cursor(request)
+    )
+    if status_code != 200:
         search_results = {
             "search_time": 0,
             "displayed": 0,
@@ -4,9 +4,28 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# "zincsearch" for a ZincSearch / Elasticsearch server at SEARCH_DB_URI, or "sqlite" for the embedded backend.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "zincsearch").lower()
+SEARCH_DB_SQLITE_PATH = os.getenv(
+    "SEARCH_DB_SQLITE_PATH", "/tmp/yarawesome_search.sqlite3"
+)
 SEARCH_DB_URI = os.getenv("SEARCH_DB_URI", "http://localhost:4080/es")
 SEARCH_DB_USER = os.getenv("SEARCH_DB_USER", "admin")
 SEARCH_DB_PASSWORD = os.getenv("SEARCH_DB_PASSWORD", "admin")
+SEARCH_DB_BULK_SIZE = int(os.getenv("SEARCH_DB_BULK_SIZE", 500))
+# How long a rule file has to stop changing before the inotify indexer picks it up, in seconds.
+YARA_INDEXER_DEBOUNCE = float(os.getenv("YARA_INDEXER_DEBOUNCE", 2.0))
+YARA_INDEXER_WORKERS = int(os.getenv("YARA_INDEXER_WORKERS", os.cpu_count() or 1))
+# Rule files parsed and indexed together.
+YARA_INDEXER_BATCH_SIZE = int(os.getenv("YARA_INDEXER_BATCH_SIZE", 100))
+SEARCH_DB_POOL_SIZE = int(os.getenv("SEARCH_DB_POOL_SIZE", 10))
+SEARCH_DB_TIMEOUT = float(os.getenv("SEARCH_DB_TIMEOUT", 30))
+SEARCH_DB_RETRIES = int(os.getenv("SEARCH_DB_RETRIES", 3))
+SEARCH_DB_RETRY_BACKOFF = float(os.getenv("SEARCH_DB_RETRY_BACKOFF", 0.5))
+# Elasticsearch accepts gzip request bodies; only enable for ZincSearch versions that do too.
+SEARCH_DB_GZIP_BULK = os.getenv("SEARCH_DB_GZIP_BULK", "false").lower() == "true"
+# Seconds between reconciliations of the search indexes with the database.
+SEARCH_DB_RECONCILE_INTERVAL = int(os.getenv("SEARCH_DB_RECONCILE_INTERVAL", 60 * 60))
 
 YARA_RULES_UPLOAD_DIRECTORY = os.getenv(
     "YARA_RULES_UPLOAD_DIRECTORY", "../sample_yara_rules/"
@@ -14,3 +33,31 @@ YARA_RULES_UPLOAD_DIRECTORY = os.getenv(
 YARA_RULES_COLLECTIONS_DIRECTORY = os.getenv(
     "YARA_RULES_COLLECTIONS_DIRECTORY", "/tmp/yara_collections/"
 )
+# Older versions of a collection's artifacts are kept so sensors can finish fetching the version they asked for.
+YARA_COLLECTION_ARTIFACT_VERSIONS = int(
+    os.getenv("YARA_COLLECTION_ARTIFACT_VERSIONS", 3)
+)
+# A queued artifact build that has not started within this many seconds is assumed lost, and queued again.
+YARA_COLLECTION_ARTIFACT_BUILD_DEBOUNCE = int(
+    os.getenv("YARA_COLLECTION_ARTIFACT_BUILD_DEBOUNCE", 60)
+)
+YARA_COMPILED_RULES_DIRECTORY = os.getenv(
+    "YARA_COMPILED_RULES_DIRECTORY", "/tmp/yara_compiled_rules/"
+)
+YARA_COMPILED_RULES_CACHE_SIZE = int(os.getenv("YARA_COMPILED_RULES_CACHE_SIZE", 32))
+YARA_SCAN_WORKERS = int(os.getenv("YARA_SCAN_WORKERS", os.cpu_count() or 1))
+YARA_SCAN_TIMEOUT = int(os.getenv("YARA_SCAN_TIMEOUT", 60))
+# Scans asking for windowed matching scan binaries larger than the window size in overlapping windows.
+YARA_SCAN_WINDOW_SIZE = int(os.getenv("YARA_SCAN_WINDOW_SIZE", 256 * 1024 * 1024))
+YARA_SCAN_WINDOW_OVERLAP = int(os.getenv("YARA_SCAN_WINDOW_OVERLAP", 1024 * 1024))
+YARA_IMPORT_FILES_PER_TASK = int(os.getenv("YARA_IMPORT_FILES_PER_TASK", 25))
+# Imports still running after this many seconds are presumed lost; the inotify rule indexer takes their files over.
+YARA_IMPORT_TIMEOUT = int(os.getenv("YARA_IMPORT_TIMEOUT", 24 * 60 * 60))
+# e.g. redis://localhost:6379/0; the in-process memory cache is used when unset. Requires the redis package.
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+SEARCH_RESULT_CACHE_TIMEOUT = int(os.getenv("SEARCH_RESULT_CACHE_TIMEOUT", 60))
+PARSED_RULE_CACHE_TIMEOUT = int(os.getenv("PARSED_RULE_CACHE_TIMEOUT", 60 * 60))
+# Rule bodies of at least this many bytes are stored zlib-compressed.
+YARA_RULE_BODY_COMPRESSION_THRESHOLD = int(
+    os.getenv("YARA_RULE_BODY_COMPRESSION_THRESHOLD", 1024)
+)
@@ -42,6 +42,16 @@ urlpatterns = [
         rule_collections_api.YaraRuleCollectionDownloadResource.as_view(),
         name="api-collection-raw",
     ),
+    path(
+        "api/collections/<str:collection_id>/compiled/",
+        rule_collections_api.YaraRuleCollectionCompiledResource.as_view(),
+        name="api-collection-compiled",
+    ),
+    path(
+        "api/collections/<str:collection_id>/changes/",
+        rule_collections_api.YaraRuleCollectionChangesResource.as_view(),
+        name="api-collection-changes",
+    ),
     path(
         "api/collections/<str:collection_id>/publish/",
         rule_collections_api.PublishYaraRuleCollectionResource.as_view(),
@@ -52,11 +62,21 @@ urlpatterns = [
         rule_lab_api.CreateUploadBinaryResource.as_view(),
         name="api-create-upload-binary",
     ),
+    path(
+        "api/lab/binaries/scan/",
+        rule_lab_api.ScanUploadBinaryBatchResource.as_view(),
+        name="api-scan-upload-binary-batch",
+    ),
     path(
         "api/lab/binaries/<str:binary_id>/scan/",
         rule_lab_api.ScanUploadBinaryResource.as_view(),
         name="api-scan-upload-binary",
     ),
+    path(
+        "api/lab/scans/<int:scan_id>/",
+        rule_lab_api.ScanJobResource.as_view(),
+        name="api-scan-job",
+    ),
     path(
         "api/rules/import/",
         rule_import_api.CreateImportJobResource.as_view(),
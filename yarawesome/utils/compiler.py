@@ -0,0 +1,247 @@
+import collections
+import glob
+import json
+import os
+import re
+import threading
+import typing
+from hashlib import sha256
+
+import yara
+from django.db.models import QuerySet
+
+from yarawesome import config
+from apps.rules.models import YaraRuleBody
+
+# An in-process LRU of compiled rulesets, keyed by ruleset digest.
+_compiled_rules_cache: "collections.OrderedDict[str, yara.Rules]" = (
+    collections.OrderedDict()
+)
+_compiled_rules_cache_lock = threading.Lock()
+
+
+def get_compiled_rules_path(digest: str) -> str:
+    """
+    Get the on-disk location of a compiled ruleset.
+
+    Args:
+        digest: The digest of the ruleset.
+
+    Returns: The path to the compiled ruleset.
+    """
+    return os.path.join(
+        config.YARA_COMPILED_RULES_DIRECTORY, digest[:2], f"{digest}.yarc"
+    )
+
+
+def get_collection_artifact_path(
+    collection_id: int, version: int, extension: str = "yara"
+) -> str:
+    """
+    Get the on-disk location of a pre-built collection artifact.
+
+    Args:
+        collection_id: The id of the collection.
+        version: The content version of the collection.
+        extension: "yara" for the concatenated source, "yara.gz" for the gzipped source, "yarc" for the compiled rules.
+
+    Returns: The path to the artifact.
+    """
+    return os.path.join(
+        config.YARA_RULES_COLLECTIONS_DIRECTORY,
+        str(collection_id),
+        f"{version}.{extension}",
+    )
+
+
+def _get_yara_rule_name(content: str) -> str:
+    match = re.search(r"\brule\s+(\w+)", content)
+    return match.group(1) if match else ""
+
+
+def get_yara_rule_namespaces(
+    yara_rules: typing.Iterable[tuple],
+) -> typing.Dict[str, typing.List[tuple]]:
+    """
+    Group YARA rules into the namespaces they are compiled in: one per collection, so a rule can refer to the other
+    (e.g. private) rules of its collection. Rules outside a collection share one namespace.
+
+    A namespace is named after the SHA-256 of its rule bodies, in order, so the same rules compile into the same
+    namespace whichever user they belong to.
+
+    Args:
+        yara_rules: An iterable of (id, name, body SHA-256, collection id) tuples, ordered by id.
+
+    Returns: A mapping of {namespace: [(id, name, body SHA-256), ...]}.
+    """
+    # A rule named like an earlier, different rule of its collection cannot share its namespace; the n-th rule of
+    # a name goes into the collection's n-th namespace.
+    rules_by_layer = {}
+    bodies_by_name = {}
+    for _id, name, body_id, collection_id in yara_rules:
+        name_bodies = bodies_by_name.setdefault((collection_id, name), [])
+        if body_id not in name_bodies:
+            name_bodies.append(body_id)
+        layer = (collection_id, name_bodies.index(body_id))
+        rules_by_layer.setdefault(layer, []).append((_id, name, body_id))
+    namespaces = {}
+    for layer_rules in rules_by_layer.values():
+        body_ids = dict.fromkeys(body_id for _, _, body_id in layer_rules)
+        namespace = sha256("\n".join(body_ids).encode("utf-8")).hexdigest()
+        namespaces.setdefault(namespace, []).extend(layer_rules)
+    return namespaces
+
+
+def get_ruleset_digest(namespaces: typing.Iterable[str]) -> str:
+    """
+    Compute a digest identifying a set of YARA rules.
+
+    Args:
+        namespaces: The namespaces of the rules, as returned by get_yara_rule_namespaces.
+
+    Returns: A hex digest that changes whenever a member rule or its content changes.
+    """
+    ruleset_hash = sha256()
+    for namespace in sorted(namespaces):
+        ruleset_hash.update(f"{namespace}\n".encode("utf-8"))
+    return ruleset_hash.hexdigest()
+
+
+def _cache_compiled_rules(digest: str, compiled_rules: yara.Rules) -> None:
+    with _compiled_rules_cache_lock:
+        _compiled_rules_cache[digest] = compiled_rules
+        _compiled_rules_cache.move_to_end(digest)
+        while len(_compiled_rules_cache) > config.YARA_COMPILED_RULES_CACHE_SIZE:
+            _compiled_rules_cache.popitem(last=False)
+
+
+def _save_compiled_rules(
+    digest: str, compiled_rules: yara.Rules, rule_ids: list, collection_ids: list
+) -> None:
+    compiled_rules_path = get_compiled_rules_path(digest)
+    os.makedirs(os.path.dirname(compiled_rules_path), exist_ok=True)
+    # Write to a temporary path first so concurrent workers never load a partial blob.
+    temp_path = f"{compiled_rules_path}.{os.getpid()}.tmp"
+    compiled_rules.save(filepath=temp_path)
+    os.replace(temp_path, compiled_rules_path)
+    with open(compiled_rules_path.replace(".yarc", ".json"), "w") as manifest_out:
+        json.dump({"rules": rule_ids, "collections": collection_ids}, manifest_out)
+
+
+def compile_yara_rules(
+    yara_rules: QuerySet,
+) -> typing.Tuple[str, yara.Rules, typing.Dict[typing.Tuple[str, str], list]]:
+    """
+    Compile a set of YARA rules, re-using a previously compiled ruleset whenever the rules are unchanged.
+
+    The rules of each collection are compiled together into one namespace (see get_yara_rule_namespaces). Rulesets
+    are keyed by content alone, so users with the same rules share a compiled ruleset.
+
+    Args:
+        yara_rules: A queryset of YaraRule instances.
+
+    Returns: A tuple containing the ruleset digest, the compiled rules, and a mapping of
+    {(namespace, rule name): [YaraRule id, ...]} to map matches back to rules.
+    """
+    # Rule bodies are keyed by the SHA-256 of their content, so a cached ruleset is found without loading any.
+    rows = list(
+        yara_rules.order_by("id").values_list("id", "name", "body_id", "collection_id")
+    )
+    unnamed_body_ids = {body_id for _, name, body_id, _ in rows if not name}
+    if unnamed_body_ids:
+        # Rules written before names were stored; matches are mapped back by name.
+        names = {
+            body_id: _get_yara_rule_name(yara_rule_body.content)
+            for body_id, yara_rule_body in YaraRuleBody.objects.in_bulk(
+                unnamed_body_ids
+            ).items()
+        }
+        rows = [
+            (_id, name or names.get(body_id, ""), body_id, collection_id)
+            for _id, name, body_id, collection_id in rows
+        ]
+    namespaces = get_yara_rule_namespaces(rows)
+    digest = get_ruleset_digest(namespaces)
+    rule_ids_by_name = {}
+    for namespace, namespace_rules in namespaces.items():
+        for _id, name, _ in namespace_rules:
+            rule_ids_by_name.setdefault((namespace, name), []).append(_id)
+
+    with _compiled_rules_cache_lock:
+        compiled_rules = _compiled_rules_cache.get(digest)
+    if compiled_rules is not None:
+        _cache_compiled_rules(digest, compiled_rules)
+        return digest, compiled_rules, rule_ids_by_name
+
+    compiled_rules_path = get_compiled_rules_path(digest)
+    if os.path.exists(compiled_rules_path):
+        try:
+            compiled_rules = yara.load(filepath=compiled_rules_path)
+        except yara.Error as e:
+            print(f"Could not load compiled rules {compiled_rules_path}: {e}")
+    if compiled_rules is None:
+        yara_rule_bodies = YaraRuleBody.objects.in_bulk(
+            {body_id for _, _, body_id, _ in rows}
+        )
+        compiled_rules = yara.compile(
+            sources={
+                namespace: "\n\n".join(
+                    yara_rule_bodies[body_id].content
+                    for body_id in dict.fromkeys(
+                        body_id for _, _, body_id in namespace_rules
+                    )
+                )
+                for namespace, namespace_rules in namespaces.items()
+            }
+        )
+        _save_compiled_rules(
+            digest,
+            compiled_rules,
+            rule_ids=sorted({_id for _id, _, _, _ in rows}),
+            collection_ids=sorted(
+                {collection_id for _, _, _, collection_id in rows if collection_id}
+            ),
+        )
+    _cache_compiled_rules(digest, compiled_rules)
+    return digest, compiled_rules, rule_ids_by_name
+
+
+def invalidate_compiled_rules(
+    rule_ids: typing.Iterable[int] = (), collection_ids: typing.Iterable[int] = ()
+) -> int:
+    """
+    Remove every compiled ruleset containing one of the given rules or collections.
+
+    Rulesets are keyed by content, so a stale ruleset is never served; this reclaims the space it occupies.
+
+    Args:
+        rule_ids: The database ids of the rules that changed.
+        collection_ids: The ids of the collections that changed.
+
+    Returns: The number of compiled rulesets removed.
+    """
+    rule_ids = set(rule_ids)
+    collection_ids = set(collection_ids)
+    removed = 0
+    for manifest_path in glob.glob(
+        os.path.join(config.YARA_COMPILED_RULES_DIRECTORY, "*", "*.json")
+    ):
+        try:
+            with open(manifest_path, "r") as manifest_in:
+                manifest = json.load(manifest_in)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if rule_ids.isdisjoint(manifest.get("rules", [])) and collection_ids.isdisjoint(
+            manifest.get("collections", [])
+        ):
+            continue
+        digest = os.path.basename(manifest_path)[: -len(".json")]
+        with _compiled_rules_cache_lock:
+            _compiled_rules_cache.pop(digest, None)
+        for path in (manifest_path, get_compiled_rules_path(digest)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
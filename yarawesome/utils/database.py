@@ -5,38 +5,103 @@ from hashlib import md5
 import plyara
 import requests
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from yarawesome import config
 from yarawesome.settings import BASE_DIR
-from apps.rules.models import ImportYaraRuleJob, YaraRule, YaraRuleCollection
+from apps.rule_collections.models import YaraRuleCollectionChange
+from apps.rules.models import (
+    ImportYaraRuleJob,
+    YaraRule,
+    YaraRuleBody,
+    YaraRuleCollection,
+    get_yara_rule_body_hash,
+    store_yara_rule_bodies,
+)
+
+from . import compiler
 
 rule_search_index = "yara-rules"
 
 
-def get_yara_rule_collection_content(user: User, collection_id: int) -> str:
-    """
-    Download a YARA rule collection.
+def get_downloadable_yara_rule_collection(
+    user: User, collection_id: int
+) -> typing.Optional[YaraRuleCollection]:
     """
+    Get a collection the user owns, or a public collection.
 
-    rules_string = ""
-    imports = []
-    yara_rule_collection = YaraRuleCollection.objects.filter(
-        id=collection_id, user=user
-    ).first()
+    Args:
+        user: The user downloading the collection.
+        collection_id: The ID of the collection.
+
+    Returns: A YaraRuleCollection instance, or None if the user cannot access the collection.
+    """
+    yara_rule_collection = None
+    if user.is_authenticated:
+        yara_rule_collection = YaraRuleCollection.objects.filter(
+            id=collection_id, user=user
+        ).first()
 
     if not yara_rule_collection:
         yara_rule_collection = YaraRuleCollection.objects.filter(
             id=collection_id, public=True
         ).first()
+    return yara_rule_collection
 
-    if not yara_rule_collection:
-        return ""
 
-    for rule in yara_rule_collection.yararule_set.all():
-        imports.extend(plyara.Plyara().parse_string(rule.content)[0].get("imports", []))
-        rules_string += "\n\n" + rule.content
+def get_yara_rule_collection_import_header(
+    yara_rule_collection: YaraRuleCollection,
+) -> str:
+    """
+    Get the import statements required by the rules in a collection, from their stored parses.
 
-    imports = set(imports)
-    import_string = "\n".join([f'import "{import_}"' for import_ in imports])
-    return import_string + rules_string
+    Args:
+        yara_rule_collection: The YaraRuleCollection instance.
+
+    Returns: The import statements.
+    """
+    yara_rules = yara_rule_collection.yararule_set
+    # Rules written before parses were stored are parsed once here.
+    for rule in (
+        yara_rules.filter(body__parsed__isnull=True).select_related("body").iterator()
+    ):
+        get_parsed_yara_rule(rule)
+    imports = set()
+    for rule_imports in yara_rules.values_list("body__parsed__imports", flat=True):
+        imports.update(rule_imports or [])
+    return "\n".join([f'import "{import_}"' for import_ in sorted(imports)])
+
+
+def iter_yara_rule_collection_content(
+    yara_rule_collection: YaraRuleCollection,
+) -> typing.Iterator[str]:
+    """
+    Iterate over the content of a collection, starting with its import header, without loading every rule at once.
+
+    Args:
+        yara_rule_collection: The YaraRuleCollection instance.
+
+    Returns: An iterator over chunks of the collection content.
+    """
+    yield get_yara_rule_collection_import_header(yara_rule_collection)
+    for yara_rule in (
+        yara_rule_collection.yararule_set.order_by("id")
+        .select_related("body")
+        .only("body__data", "body__compressed")
+        .iterator(chunk_size=500)
+    ):
+        yield "\n\n" + yara_rule.content
+
+
+def get_yara_rule_collection_content(user: User, collection_id: int) -> str:
+    """
+    Download a YARA rule collection.
+    """
+    yara_rule_collection = get_downloadable_yara_rule_collection(user, collection_id)
+    if not yara_rule_collection:
+        return ""
+    return "".join(iter_yara_rule_collection_content(yara_rule_collection))
 
 
 def get_yara_rules_content(
@@ -45,23 +110,85 @@ def get_yara_rules_content(
     """
     Download a YARA rule collection.
     """
-    rules_string = ""
+    rule_contents = []
     imports = []
     if user:
-        for rule in YaraRule.objects.filter(id__in=rule_ids, user=user).all():
-            rules_string += "\n\n" + rule.content
-            imports.extend(
-                plyara.Plyara().parse_string(rule.content)[0].get("imports", [])
-            )
+        yara_rules = YaraRule.objects.filter(id__in=rule_ids, user=user)
     else:
-        for rule in YaraRule.objects.filter(id__in=rule_ids, public=True).all():
-            rules_string += "\n\n" + rule.content
-            imports.extend(
-                plyara.Plyara().parse_string(rule.content)[0].get("imports", [])
-            )
+        yara_rules = YaraRule.objects.filter(id__in=rule_ids, public=True)
+    for rule in yara_rules.select_related("body").iterator():
+        rule_contents.append("\n\n" + rule.content)
+        imports.extend(get_parsed_yara_rule(rule).get("imports", []))
     imports = set(imports)
     import_string = "\n".join([f'import "{import_}"' for import_ in imports])
-    return import_string + rules_string
+    return import_string + "".join(rule_contents)
+
+
+def parse_yara_rule_content(
+    content: str, content_hash: typing.Optional[str] = None
+) -> dict:
+    """
+    Parse the content of a single YARA rule with plyara, caching the result by content hash.
+
+    Args:
+        content: The content of the rule.
+        content_hash: The SHA-256 of the content, if known; the hash its YaraRuleBody is stored under.
+
+    Returns: The rule as parsed by plyara.
+    """
+    content_hash = content_hash or get_yara_rule_body_hash(content)
+    cache_key = f"parsed-yara-rule:{content_hash}"
+    parsed_yara_rule = cache.get(cache_key)
+    if parsed_yara_rule is None:
+        parsed_yara_rule = plyara.Plyara().parse_string(content)[0]
+        cache.set(cache_key, parsed_yara_rule, config.PARSED_RULE_CACHE_TIMEOUT)
+    return parsed_yara_rule
+
+
+def get_yara_rule_summary(parsed_yara_rule: dict) -> dict:
+    """
+    Get the name, description and author of a rule parsed by plyara.
+
+    Args:
+        parsed_yara_rule: The rule as parsed by plyara.
+
+    Returns: A dictionary of YaraRule field values.
+    """
+    metadata = {
+        key: value
+        for d in parsed_yara_rule.get("metadata", [])
+        for key, value in d.items()
+    }
+    return {
+        "name": parsed_yara_rule.get("rule_name", ""),
+        "description": str(metadata.get("description", "")),
+        "author": str(metadata.get("author", "")),
+    }
+
+
+def get_parsed_yara_rule(yara_rule: YaraRule) -> dict:
+    """
+    Get a rule as parsed by plyara, from its body when it was stored at write time.
+    Bodies written before parsed rules were stored are parsed once and updated in place, as is the rule's summary.
+
+    Args:
+        yara_rule: The YaraRule instance.
+
+    Returns: The rule as parsed by plyara.
+    """
+    yara_rule_body = yara_rule.body
+    if yara_rule_body.parsed is None:
+        yara_rule_body.parsed = parse_yara_rule_content(
+            yara_rule_body.content, content_hash=yara_rule_body.sha256
+        )
+        YaraRuleBody.objects.filter(sha256=yara_rule_body.sha256).update(
+            parsed=yara_rule_body.parsed
+        )
+        summary = get_yara_rule_summary(yara_rule_body.parsed)
+        for field, value in summary.items():
+            setattr(yara_rule, field, value)
+        YaraRule.objects.filter(id=yara_rule.id).update(**summary)
+    return yara_rule_body.parsed
 
 
 def get_icon_id_from_string(string: str):
@@ -94,10 +221,10 @@ def lookup_yara_rule(rule_id: str, user: typing.Optional[User] = None) -> YaraRu
         requests.Response: The API response.
     """
     if not user:
-        yara_rule = YaraRule.objects.filter(rule_id=rule_id).first()
+        yara_rules = YaraRule.objects.filter(rule_id=rule_id)
     else:
-        yara_rule = YaraRule.objects.filter(rule_id=rule_id, user=user).first()
-    return yara_rule
+        yara_rules = YaraRule.objects.filter(rule_id=rule_id, user=user)
+    return yara_rules.select_related("body").first()
 
 
 def parse_lookup_rule_response(yara_rule: YaraRule) -> dict:
@@ -111,18 +238,12 @@ def parse_lookup_rule_response(yara_rule: YaraRule) -> dict:
         dict: Parsed rule information.
     """
     try:
-        yara_rule_parser = plyara.Plyara()
-        parsed_yara_rule = yara_rule_parser.parse_string(yara_rule.content)[0]
-        parsed_yara_rule["metadata"] = {
-            key: value
-            for d in parsed_yara_rule.get("metadata", [])
-            for key, value in d.items()
-        }
+        get_parsed_yara_rule(yara_rule)
         yara_rule = {
             "rule_id": yara_rule.rule_id,
-            "name": parsed_yara_rule.get("rule_name"),
-            "description": parsed_yara_rule["metadata"].get("description", ""),
-            "author": parsed_yara_rule["metadata"].get("author", ""),
+            "name": yara_rule.name,
+            "description": yara_rule.description,
+            "author": yara_rule.author,
             "rule": yara_rule.content,
             "collection": {
                 "id": yara_rule.collection.id,
@@ -136,6 +257,187 @@ def parse_lookup_rule_response(yara_rule: YaraRule) -> dict:
         return {"yara_rule": None}
 
 
+def get_parsed_yara_rule_fields(parsed_rule: dict) -> dict:
+    """
+    Get the summary YaraRule field values of a rule flattened by parse_yara_rules_from_raw.
+
+    Args:
+        parsed_rule: A dictionary containing parsed YARA rule information.
+
+    Returns: A dictionary of YaraRule field values; empty if the rule was flattened without its parse.
+    """
+    if not parsed_rule.get("parsed"):
+        return {}
+    return get_yara_rule_summary(parsed_rule["parsed"])
+
+
+def record_yara_rule_collection_changes(
+    collection_id: typing.Optional[int],
+    action: str,
+    rule_ids: typing.Iterable[str] = (),
+) -> typing.Optional[int]:
+    """
+    Increment the content version of a collection, and record the changes that produced it.
+    Publishing or unpublishing leaves the content, and so the version, unchanged; it is recorded at the current one.
+
+    Args:
+        collection_id: The ID of the collection.
+        action: One of the YaraRuleCollectionChange actions.
+        rule_ids: The rule_ids of the rules that changed; empty for changes to the collection itself.
+
+    Returns: The (new) version of the collection, or None if the collection does not exist.
+    """
+    if not collection_id:
+        return None
+    rule_ids = sorted(set(rule_ids)) or [""]
+    with transaction.atomic():
+        # Lock the collection row, so concurrent writers are given distinct versions.
+        version = (
+            YaraRuleCollection.objects.select_for_update()
+            .filter(id=collection_id)
+            .values_list("version", flat=True)
+            .first()
+        )
+        if version is None:
+            return None
+        if action not in (
+            YaraRuleCollectionChange.PUBLISHED,
+            YaraRuleCollectionChange.UNPUBLISHED,
+        ):
+            version += 1
+            YaraRuleCollection.objects.filter(id=collection_id).update(version=version)
+        YaraRuleCollectionChange.objects.bulk_create(
+            [
+                YaraRuleCollectionChange(
+                    collection_id=collection_id,
+                    sequence=version,
+                    rule_id=rule_id,
+                    action=action,
+                )
+                for rule_id in rule_ids
+            ],
+            batch_size=500,
+        )
+    return version
+
+
+def get_yara_rule_collection_changes(
+    yara_rule_collection: YaraRuleCollection, since: int, max_results: int = 1000
+) -> dict:
+    """
+    Get the rules added, modified and removed from a collection after a version.
+    Each rule is reported once, in its current state; a rule added and removed again is not reported at all.
+
+    Args:
+        yara_rule_collection: The YaraRuleCollection instance.
+        since: The version of the collection the consumer holds.
+        max_results: The maximum number of changes to read. Changes made at the same version are never split.
+
+    Returns: A dictionary of the changes and the version they bring the consumer up to.
+    """
+    changes = {
+        "collection_id": yara_rule_collection.id,
+        "version": yara_rule_collection.version,
+        "public": yara_rule_collection.public,
+        "since": since,
+        "next": since,
+        # Consumers without a (valid) version must download the whole collection.
+        "reset": since < 1 or since > yara_rule_collection.version,
+        "added": [],
+        "modified": [],
+        "removed": [],
+    }
+    if changes["reset"]:
+        changes["next"] = yara_rule_collection.version
+        return changes
+
+    collection_changes = list(
+        YaraRuleCollectionChange.objects.filter(
+            collection=yara_rule_collection, sequence__gt=since
+        )
+        .exclude(rule_id="")
+        .order_by("sequence", "id")
+        .values_list("sequence", "rule_id", "action")[: max_results + 1]
+    )
+    if len(collection_changes) > max_results:
+        last_sequence = collection_changes[max_results][0]
+        complete_changes = [c for c in collection_changes if c[0] < last_sequence]
+        if complete_changes:
+            collection_changes = complete_changes
+        else:
+            collection_changes = list(
+                YaraRuleCollectionChange.objects.filter(
+                    collection=yara_rule_collection, sequence=last_sequence
+                )
+                .exclude(rule_id="")
+                .values_list("sequence", "rule_id", "action")
+            )
+        changes["next"] = collection_changes[-1][0]
+    else:
+        changes["next"] = yara_rule_collection.version
+
+    first_actions = {}
+    for _, rule_id, action in collection_changes:
+        first_actions.setdefault(rule_id, action)
+    current_rules = {
+        yara_rule.rule_id: yara_rule
+        for yara_rule in yara_rule_collection.yararule_set.select_related(
+            "body"
+        ).filter(rule_id__in=first_actions.keys())
+    }
+    for rule_id, first_action in first_actions.items():
+        yara_rule = current_rules.get(rule_id)
+        if yara_rule:
+            change = "modified"
+            if first_action == YaraRuleCollectionChange.ADDED:
+                change = "added"
+            changes[change].append(
+                {
+                    "rule_id": yara_rule.rule_id,
+                    "name": yara_rule.name,
+                    "rule": yara_rule.content,
+                }
+            )
+        elif first_action != YaraRuleCollectionChange.ADDED:
+            changes["removed"].append(rule_id)
+    return changes
+
+
+def get_or_create_import_collection(
+    import_job: ImportYaraRuleJob, collection_name: str
+) -> YaraRuleCollection:
+    """
+    Get the collection an import job writes a directory of rules to, creating it if necessary.
+
+    Args:
+        import_job: The import job.
+        collection_name: The name of the collection.
+
+    Returns: A YaraRuleCollection instance.
+    """
+    try:
+        # Concurrent writers of the same import race to create its collections; the unique constraint picks one.
+        with transaction.atomic():
+            yara_rule_collection, created = YaraRuleCollection.objects.get_or_create(
+                import_job=import_job,
+                name=collection_name,
+                defaults={
+                    "description": f"Generated from {collection_name}.",
+                    "user": import_job.user,
+                    "icon": get_icon_id_from_string(collection_name),
+                },
+            )
+    except IntegrityError:
+        return YaraRuleCollection.objects.get(
+            import_job=import_job, name=collection_name
+        )
+    if created:
+        print(
+            f"Creating new collection {yara_rule_collection.name} ({yara_rule_collection.id})"
+        )
+    return yara_rule_collection
+
+
 def write_yara_rule_record(
     parsed_rule: dict,
     user: typing.Optional[User] = None,
@@ -159,43 +461,156 @@ def write_yara_rule_record(
             # This can occur when the import job is deleted.
             return None
 
-        yara_rule_collection = YaraRuleCollection()
-        yara_rule_collection.name = collection_name
-        yara_rule_collection.description = (
-            f"Generated from {yara_rule_collection.name}."
+        yara_rule_collection = get_or_create_import_collection(
+            import_job, collection_name
         )
-        if not YaraRuleCollection.objects.filter(
-            import_job=import_job, name=collection_name
-        ).exists():
-            yara_rule_collection.user = import_job.user
-            yara_rule_collection.import_job = import_job
-            yara_rule_collection.icon = get_icon_id_from_string(collection_name)
-            yara_rule_collection.save()
-            print(
-                f"Creating new collection {yara_rule_collection.name} ({yara_rule_collection.id})"
-            )
-        else:
-            yara_rule_collection = (
-                YaraRuleCollection.objects.filter(
-                    import_job__id=import_id, name=collection_name
-                )
-                .all()
-                .latest("id")
-            )
         yara_rule = YaraRule(
             rule_id=parsed_rule["rule_id"],
-            content=parsed_rule["content"],
             user=import_job.user,
             import_job=import_job,
             collection=yara_rule_collection,
+            **get_parsed_yara_rule_fields(parsed_rule),
         )
+        yara_rule.set_content(parsed_rule["content"], parsed_rule.get("parsed"))
         yara_rule.save()
+        record_yara_rule_collection_changes(
+            yara_rule_collection.id, YaraRuleCollectionChange.ADDED, [yara_rule.rule_id]
+        )
         return yara_rule
     else:
         yara_rule = YaraRule.objects.filter(
             rule_id=parsed_rule["rule_id"], user=user
         ).first()
         if yara_rule:
-            yara_rule.content = parsed_rule["content"]
+            yara_rule.set_content(parsed_rule["content"], parsed_rule.get("parsed"))
+            for field, value in get_parsed_yara_rule_fields(parsed_rule).items():
+                setattr(yara_rule, field, value)
             yara_rule.save()
+            compiler.invalidate_compiled_rules(rule_ids=[yara_rule.id])
+            record_yara_rule_collection_changes(
+                yara_rule.collection_id,
+                YaraRuleCollectionChange.MODIFIED,
+                [yara_rule.rule_id],
+            )
         return yara_rule
+
+
+def bulk_write_yara_rule_records(
+    parsed_rules: typing.List[dict],
+    import_job: ImportYaraRuleJob,
+    yara_rule_collection: YaraRuleCollection,
+) -> typing.List[YaraRule]:
+    """
+    Write parsed YARA rules belonging to one import collection to the database in bulk.
+    Rules already present in the collection are skipped.
+
+    Args:
+        parsed_rules: Dictionaries containing parsed YARA rule information.
+        import_job: The import job the rules belong to.
+        yara_rule_collection: The collection to write the rules to.
+
+    Returns: The YaraRule instances written to the database.
+    """
+    existing_rule_ids = set(
+        yara_rule_collection.yararule_set.filter(
+            rule_id__in=[parsed_rule["rule_id"] for parsed_rule in parsed_rules]
+        ).values_list("rule_id", flat=True)
+    )
+    new_rules = {}
+    for parsed_rule in parsed_rules:
+        if parsed_rule["rule_id"] not in existing_rule_ids:
+            new_rules.setdefault(parsed_rule["rule_id"], parsed_rule)
+    if not new_rules:
+        return []
+    # Rules that are already known, from any user, only add a row pointing at the stored body.
+    body_ids = store_yara_rule_bodies(
+        [parsed_rule["content"] for parsed_rule in new_rules.values()],
+        [parsed_rule.get("parsed") for parsed_rule in new_rules.values()],
+    )
+    yara_rules = YaraRule.objects.bulk_create(
+        [
+            YaraRule(
+                rule_id=parsed_rule["rule_id"],
+                body_id=body_id,
+                user=import_job.user,
+                import_job=import_job,
+                collection=yara_rule_collection,
+                **get_parsed_yara_rule_fields(parsed_rule),
+            )
+            for parsed_rule, body_id in zip(new_rules.values(), body_ids)
+        ],
+        batch_size=500,
+        # A concurrent writer of the same collection may still have inserted some of them.
+        ignore_conflicts=True,
+    )
+    record_yara_rule_collection_changes(
+        yara_rule_collection.id, YaraRuleCollectionChange.ADDED, new_rules
+    )
+    return yara_rules
+
+
+def delete_yara_rule_record(yara_rule: YaraRule) -> None:
+    """
+    Delete a YARA rule from the database, recording its removal from its collection.
+
+    Args:
+        yara_rule: The YaraRule instance.
+    """
+    delete_yara_rule_records([yara_rule])
+
+
+def delete_yara_rule_records(yara_rules: typing.Iterable[YaraRule]) -> None:
+    """
+    Delete YARA rules from the database, recording their removal from their collections.
+
+    Args:
+        yara_rules: The YaraRule instances.
+    """
+    removed_rule_ids_by_collection = {}
+    for yara_rule in yara_rules:
+        removed_rule_ids_by_collection.setdefault(yara_rule.collection_id, {})[
+            yara_rule.id
+        ] = yara_rule.rule_id
+    yara_rule_ids = [
+        yara_rule_id
+        for removed in removed_rule_ids_by_collection.values()
+        for yara_rule_id in removed
+    ]
+    if not yara_rule_ids:
+        return
+    compiler.invalidate_compiled_rules(rule_ids=yara_rule_ids)
+    YaraRule.objects.filter(id__in=yara_rule_ids).delete()
+    for collection_id, removed in removed_rule_ids_by_collection.items():
+        record_yara_rule_collection_changes(
+            collection_id, YaraRuleCollectionChange.REMOVED, removed.values()
+        )
+
+
+def delete_unreferenced_yara_rule_bodies(min_age: int = 60 * 60) -> int:
+    """
+    Delete stored rule bodies no rule refers to any more.
+
+    Args:
+        min_age: How long ago, in seconds, an unreferenced body has to have last been referenced; a body that was
+        referenced more recently may be about to be referenced by a rule that is being written.
+
+    Returns: The number of bodies deleted.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            # Lock the candidates; a writer touching one of them waits until it is deleted, and then re-creates it.
+            body_ids = list(
+                YaraRuleBody.objects.select_for_update(of=("self",))
+                .filter(
+                    yararule__isnull=True,
+                    last_referenced_time__lt=timezone.now()
+                    - timezone.timedelta(seconds=min_age),
+                )
+                .values_list("sha256", flat=True)[:500]
+            )
+            if not body_ids:
+                return deleted
+            deleted += YaraRuleBody.objects.filter(
+                sha256__in=body_ids, yararule__isnull=True
+            ).delete()[0]
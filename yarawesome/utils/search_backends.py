@@ -0,0 +1,650 @@
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from abc import abstractmethod
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from yarawesome import config
+
+
+class SearchBackend:
+    """
+    The interface of a search backend. Requests and responses follow the Elasticsearch API.
+    """
+
+    @abstractmethod
+    def create_index(self, index: str, body: dict) -> requests.Response:
+        """
+        Create an index.
+
+        Args:
+            index: The name of the index.
+            body: The settings and mappings of the index.
+
+        Returns: The API response; an error status if the index already exists.
+        """
+
+    @abstractmethod
+    def get_mapping(self, index: str) -> requests.Response:
+        """
+        Get the mappings of an index.
+
+        Args:
+            index: The name of the index.
+
+        Returns: The API response, the mappings keyed by index name; 404 if the index does not exist.
+        """
+
+    @abstractmethod
+    def search(self, index: str, payload: dict) -> requests.Response:
+        """
+        Search an index.
+
+        Args:
+            index: The name of the index.
+            payload: The Elasticsearch query DSL body.
+
+        Returns: The API response; 404 if the index does not exist.
+        """
+
+    @abstractmethod
+    def put_document(
+        self, index: str, document_id: str, document: dict
+    ) -> requests.Response:
+        """
+        Create or replace a single document.
+
+        Args:
+            index: The name of the index.
+            document_id: The id of the document.
+            document: The document.
+
+        Returns: The API response.
+        """
+
+    @abstractmethod
+    def delete_document(self, index: str, document_id: str) -> requests.Response:
+        """
+        Delete a single document.
+
+        Args:
+            index: The name of the index.
+            document_id: The id of the document.
+
+        Returns: The API response; 404 if the document does not exist.
+        """
+
+    @abstractmethod
+    def bulk(self, index: str, actions: typing.List[dict]) -> requests.Response:
+        """
+        Submit a _bulk request.
+
+        Args:
+            index: The name of the default index.
+            actions: The action and document lines of the request.
+
+        Returns: The API response.
+        """
+
+
+class ZincSearchBackend(SearchBackend):
+    """
+    A client for the ZincSearch / Elasticsearch backend that keeps a pool of keep-alive connections open.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        user: str,
+        password: str,
+        pool_size: int = 10,
+        timeout: float = 30,
+        retries: int = 3,
+        retry_backoff: float = 0.5,
+        gzip_bulk: bool = False,
+    ):
+        self.uri = uri.rstrip("/")
+        self.timeout = timeout
+        self.gzip_bulk = gzip_bulk
+        self.session = requests.Session()
+        self.session.auth = (user, password)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=retry_backoff,
+                status_forcelist=(429, 502, 503, 504),
+                # Searches are read-only and documents are written by id, so every request is safe to retry.
+                allowed_methods=None,
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def create_index(self, index: str, body: dict) -> requests.Response:
+        """
+        Create an index.
+
+        Args:
+            index: The name of the index.
+            body: The settings and mappings of the index.
+
+        Returns: The API response; an error status if the index already exists.
+        """
+        return self.session.put(f"{self.uri}/{index}", json=body, timeout=self.timeout)
+
+    def get_mapping(self, index: str) -> requests.Response:
+        """
+        Get the mappings of an index.
+
+        Args:
+            index: The name of the index.
+
+        Returns: The API response, the mappings keyed by index name; 404 if the index does not exist.
+        """
+        return self.session.get(f"{self.uri}/{index}/_mapping", timeout=self.timeout)
+
+    def search(self, index: str, payload: dict) -> requests.Response:
+        """
+        Search an index.
+
+        Args:
+            index: The name of the index.
+            payload: The Elasticsearch query DSL body.
+
+        Returns: The API response.
+        """
+        return self.session.post(
+            f"{self.uri}/{index}/_search", json=payload, timeout=self.timeout
+        )
+
+    def put_document(
+        self, index: str, document_id: str, document: dict
+    ) -> requests.Response:
+        """
+        Create or replace a single document.
+
+        Args:
+            index: The name of the index.
+            document_id: The id of the document.
+            document: The document.
+
+        Returns: The API response.
+        """
+        return self.session.put(
+            f"{self.uri}/{index}/_doc/{document_id}",
+            json=document,
+            timeout=self.timeout,
+        )
+
+    def delete_document(self, index: str, document_id: str) -> requests.Response:
+        """
+        Delete a single document.
+
+        Args:
+            index: The name of the index.
+            document_id: The id of the document.
+
+        Returns: The API response; 404 if the document does not exist.
+        """
+        return self.session.delete(
+            f"{self.uri}/{index}/_doc/{document_id}", timeout=self.timeout
+        )
+
+    def bulk(self, index: str, actions: typing.List[dict]) -> requests.Response:
+        """
+        Submit a _bulk request.
+
+        Args:
+            index: The name of the default index.
+            actions: The action and document lines of the request.
+
+        Returns: The API response.
+        """
+        body = ("\n".join(json.dumps(action) for action in actions) + "\n").encode(
+            "utf-8"
+        )
+        headers = {"Content-Type": "application/x-ndjson"}
+        if self.gzip_bulk:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        return self.session.post(
+            f"{self.uri}/{index}/_bulk",
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+        )
+
+
+def _json_response(status_code: int, body: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode("utf-8")
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+# Document fields searched by the full text columns of the embedded backend. Every other field is searched as meta.
+_fts_columns = {
+    "name": "name",
+    "condition": "condition",
+    "variables": "strings",
+    "values": "strings",
+}
+# Document fields only used for filtering and sorting, never full text searched.
+_keyword_fields = {"rule_id", "collection_id", "import_id", "user_id", "public"}
+_query_string_token = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+
+
+def _get_document_text(document: dict) -> typing.Dict[str, str]:
+    text = {"name": [], "condition": [], "strings": [], "meta": []}
+    for field, value in document.items():
+        if field in _keyword_fields or field.startswith("@"):
+            continue
+        values = value if isinstance(value, list) else [value]
+        text[_fts_columns.get(field, "meta")].extend(str(v) for v in values)
+    return {column: " ".join(values) for column, values in text.items()}
+
+
+def _quote_fts_term(term: str) -> str:
+    prefix = term.endswith("*")
+    term = term.strip('"').replace("*", "").replace("?", "")
+    if not term:
+        return ""
+    quoted = '"' + term.replace('"', '""') + '"'
+    return f"{quoted}*" if prefix else quoted
+
+
+def _query_string_term_to_sql(token: str, parameters: list) -> str:
+    field, _, value = token.partition(":")
+    if not value or token.startswith('"'):
+        field, value = "", token.lstrip("+")
+    term = value.strip('"').replace("*", "").replace("?", "")
+    if not term:
+        # A bare wildcard matches every document.
+        return "1"
+    like_term = re.sub(r"([\\%_])", r"\\\1", term)
+    if field in _keyword_fields:
+        # Keyword fields are not full text searched; they are compared against the stored document.
+        if field == "public":
+            parameters.extend([_json_path(field), int(term.lower() == "true")])
+            return "json_extract(d.source, ?) = ?"
+        if value.endswith("*"):
+            parameters.extend([_json_path(field), f"{like_term}%"])
+            return "json_extract(d.source, ?) LIKE ? ESCAPE '\\'"
+        parameters.extend([_json_path(field), term])
+        return "json_extract(d.source, ?) = ?"
+    fts_term = _quote_fts_term(value)
+    if field:
+        fts_term = f"{_fts_columns.get(field, 'meta')} : {fts_term}"
+    parameters.append(fts_term)
+    clause = "d.rowid IN (SELECT rowid FROM search_documents_fts WHERE search_documents_fts MATCH ?)"
+    if field and field not in _fts_columns:
+        # Every other field shares the meta column; the stored document narrows the match down to the field.
+        parameters.extend([_json_path(field), f"%{like_term}%"])
+        clause = f"({clause} AND json_extract(d.source, ?) LIKE ? ESCAPE '\\')"
+    return clause
+
+
+def query_string_to_sql(query: str) -> typing.Optional[typing.Tuple[str, list]]:
+    """
+    Translate the subset of the query_string syntax used to search rules into a SQL condition on the documents:
+    terms, "quoted phrases", prefix* wildcards, field:value, AND / OR / NOT and parentheses. Terms without an
+    operator between them are OR'ed, as in Elasticsearch.
+
+    Terms are matched against the FTS5 table, except for keyword fields (e.g. rule_id or collection_id), which are
+    compared against the stored document exactly, as Elasticsearch does.
+
+    Args:
+        query: The query string.
+
+    Returns: The condition and its parameters, or None if the query matches every document.
+    """
+    operators = {"AND": "AND", "&&": "AND", "OR": "OR", "||": "OR", "NOT": "NOT"}
+    expression = []
+    parameters = []
+    for token in _query_string_token.findall(query):
+        follows_term = expression and expression[-1] not in ("AND", "OR", "NOT", "(")
+        if token in operators:
+            if token == "NOT" and follows_term:
+                # "a NOT b" excludes b from the matches of a.
+                expression.append("AND")
+            expression.append(operators[token])
+            continue
+        if token == ")":
+            expression.append(token)
+            continue
+        if token != "(":
+            token = _query_string_term_to_sql(token, parameters)
+        if follows_term:
+            expression.append("OR")
+        expression.append(token)
+    if not expression or expression == ["1"]:
+        return None
+    return " ".join(expression), parameters
+
+
+def _sort_keys(sort: list) -> typing.List[typing.Tuple[str, bool]]:
+    sort_keys = []
+    for sort_key in sort or []:
+        if isinstance(sort_key, str):
+            sort_keys.append((sort_key.lstrip("-"), sort_key.startswith("-")))
+        else:
+            for field, order in sort_key.items():
+                if isinstance(order, dict):
+                    order = order.get("order", "asc")
+                sort_keys.append((field, order == "desc"))
+    return sort_keys
+
+
+def _json_path(field: str) -> str:
+    # Field names are interpolated into SQL, so only word characters, "@", "." and "-" are kept.
+    return '$."' + re.sub(r"[^\w@.-]", "", field) + '"'
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+    An embedded search backend, storing documents in SQLite with an FTS5 table over their rule name, condition,
+    strings and meta. Supports the query subset used by search_index: match_all, bool must/filter, query_string,
+    term filters, sort, from/size and search_after.
+    """
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS search_indexes (
+                    name TEXT PRIMARY KEY,
+                    body TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS search_documents (
+                    rowid INTEGER PRIMARY KEY,
+                    index_name TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    UNIQUE (index_name, document_id)
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5(
+                    name, condition, strings, meta
+                );
+                """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _index_exists(self, connection: sqlite3.Connection, index: str) -> bool:
+        return (
+            connection.execute(
+                "SELECT 1 FROM search_indexes WHERE name = ?", (index,)
+            ).fetchone()
+            is not None
+        )
+
+    def _put(
+        self,
+        connection: sqlite3.Connection,
+        index: str,
+        document_id: typing.Optional[str],
+        document: dict,
+    ) -> str:
+        connection.execute(
+            "INSERT OR IGNORE INTO search_indexes (name, body) VALUES (?, '{}')",
+            (index,),
+        )
+        document_id = document_id or uuid.uuid4().hex
+        document = {
+            "@timestamp": datetime.now(timezone.utc).isoformat(),
+            **document,
+        }
+        self._delete(connection, index, document_id)
+        cursor = connection.execute(
+            "INSERT INTO search_documents (index_name, document_id, source) VALUES (?, ?, ?)",
+            (index, document_id, json.dumps(document)),
+        )
+        text = _get_document_text(document)
+        connection.execute(
+            "INSERT INTO search_documents_fts (rowid, name, condition, strings, meta) VALUES (?, ?, ?, ?, ?)",
+            (
+                cursor.lastrowid,
+                text["name"],
+                text["condition"],
+                text["strings"],
+                text["meta"],
+            ),
+        )
+        return document_id
+
+    def _delete(
+        self, connection: sqlite3.Connection, index: str, document_id: str
+    ) -> bool:
+        row = connection.execute(
+            "SELECT rowid FROM search_documents WHERE index_name = ? AND document_id = ?",
+            (index, document_id),
+        ).fetchone()
+        if row is None:
+            return False
+        connection.execute("DELETE FROM search_documents WHERE rowid = ?", row)
+        connection.execute("DELETE FROM search_documents_fts WHERE rowid = ?", row)
+        return True
+
+    def _build_query(
+        self, query: dict, clauses: typing.List[str], parameters: list
+    ) -> None:
+        if not query or "match_all" in query:
+            return
+        if "bool" in query:
+            for key in ("must", "filter"):
+                sub_queries = query["bool"].get(key, [])
+                if isinstance(sub_queries, dict):
+                    sub_queries = [sub_queries]
+                for sub_query in sub_queries:
+                    self._build_query(sub_query, clauses, parameters)
+        elif "term" in query:
+            for field, value in query["term"].items():
+                if isinstance(value, dict):
+                    value = value.get("value")
+                clauses.append("json_extract(d.source, ?) = ?")
+                parameters.extend([_json_path(field), value])
+        elif "query_string" in query:
+            condition = query_string_to_sql(query["query_string"].get("query", "*"))
+            if condition:
+                clauses.append(f"({condition[0]})")
+                parameters.extend(condition[1])
+        else:
+            raise ValueError(f"Unsupported query: {list(query)}")
+
+    def create_index(self, index: str, body: dict) -> requests.Response:
+        connection = self._connection()
+        with connection:
+            if self._index_exists(connection, index):
+                return _json_response(400, {"error": f"index [{index}] already exists"})
+            connection.execute(
+                "INSERT INTO search_indexes (name, body) VALUES (?, ?)",
+                (index, json.dumps(body)),
+            )
+        return _json_response(200, {"acknowledged": True, "index": index})
+
+    def get_mapping(self, index: str) -> requests.Response:
+        row = (
+            self._connection()
+            .execute("SELECT body FROM search_indexes WHERE name = ?", (index,))
+            .fetchone()
+        )
+        if row is None:
+            return _json_response(404, {"error": f"index [{index}] does not exist"})
+        return _json_response(
+            200, {index: {"mappings": json.loads(row[0]).get("mappings", {})}}
+        )
+
+    def search(self, index: str, payload: dict) -> requests.Response:
+        started = time.monotonic()
+        connection = self._connection()
+        if not self._index_exists(connection, index):
+            return _json_response(404, {"error": f"index [{index}] does not exist"})
+        clauses = ["d.index_name = ?"]
+        parameters = [index]
+        try:
+            self._build_query(payload.get("query", {}), clauses, parameters)
+        except ValueError as e:
+            return _json_response(400, {"error": str(e)})
+        sort_keys = _sort_keys(payload.get("sort"))
+        sort_columns = [
+            (f"json_extract(d.source, '{_json_path(field)}')", descending)
+            for field, descending in sort_keys
+        ]
+        # The document id breaks ties, so paging with search_after never skips a document.
+        sort_columns.append(("d.document_id", False))
+
+        search_clauses, search_parameters = list(clauses), list(parameters)
+        search_after = payload.get("search_after")
+        if search_after:
+            after_clauses = []
+            for i, value in enumerate(search_after[: len(sort_columns)]):
+                column, descending = sort_columns[i]
+                equal = [f"{c} = ?" for c, _ in sort_columns[:i]]
+                after_clauses.append(
+                    "("
+                    + " AND ".join(equal + [f"{column} {'<' if descending else '>'} ?"])
+                    + ")"
+                )
+                search_parameters.extend(search_after[:i] + [value])
+            search_clauses.append("(" + " OR ".join(after_clauses) + ")")
+
+        order_by = ", ".join(
+            f"{column} {'DESC' if descending else 'ASC'}"
+            for column, descending in sort_columns
+        )
+        try:
+            total = connection.execute(
+                f"SELECT COUNT(*) FROM search_documents d WHERE {' AND '.join(clauses)}",
+                parameters,
+            ).fetchone()[0]
+            rows = connection.execute(
+                f"SELECT d.document_id, d.source, "
+                f"{', '.join(column for column, _ in sort_columns)} "
+                f"FROM search_documents d WHERE {' AND '.join(search_clauses)} "
+                f"ORDER BY {order_by} LIMIT ? OFFSET ?",
+                search_parameters
+                + [int(payload.get("size", 10)), int(payload.get("from", 0))],
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            # Most likely a query string that is not a valid match expression.
+            return _json_response(400, {"error": str(e)})
+        hits = [
+            {
+                "_index": index,
+                "_id": row[0],
+                "_source": json.loads(row[1]),
+                "sort": list(row[2:]),
+            }
+            for row in rows
+        ]
+        return _json_response(
+            200,
+            {
+                "took": int((time.monotonic() - started) * 1000),
+                "hits": {"total": {"value": total}, "hits": hits},
+            },
+        )
+
+    def put_document(
+        self, index: str, document_id: str, document: dict
+    ) -> requests.Response:
+        connection = self._connection()
+        with connection:
+            document_id = self._put(connection, index, document_id, document)
+        return _json_response(200, {"_index": index, "_id": document_id})
+
+    def delete_document(self, index: str, document_id: str) -> requests.Response:
+        connection = self._connection()
+        with connection:
+            deleted = self._delete(connection, index, document_id)
+        return _json_response(
+            200 if deleted else 404,
+            {
+                "_index": index,
+                "_id": document_id,
+                "result": "deleted" if deleted else "not_found",
+            },
+        )
+
+    def bulk(self, index: str, actions: typing.List[dict]) -> requests.Response:
+        items = []
+        connection = self._connection()
+        with connection:
+            i = 0
+            while i < len(actions):
+                action, metadata = next(iter(actions[i].items()))
+                action_index = metadata.get("_index", index)
+                if action == "delete":
+                    deleted = self._delete(connection, action_index, metadata["_id"])
+                    items.append(
+                        {
+                            "delete": {
+                                "_id": metadata["_id"],
+                                "status": 200 if deleted else 404,
+                            }
+                        }
+                    )
+                    i += 1
+                else:
+                    document_id = self._put(
+                        connection, action_index, metadata.get("_id"), actions[i + 1]
+                    )
+                    items.append({action: {"_id": document_id, "status": 200}})
+                    i += 2
+        return _json_response(200, {"errors": False, "items": items})
+
+
+_search_backend = None
+_search_backend_pid = None
+
+
+def get_search_backend() -> SearchBackend:
+    """
+    Get the search backend client for this process, as selected by SEARCH_BACKEND.
+    Connection pools must not be shared across a fork, so a new client is created in each (Celery) worker process.
+
+    Returns: The search backend client.
+    """
+    global _search_backend, _search_backend_pid
+    if _search_backend is None or _search_backend_pid != os.getpid():
+        if config.SEARCH_BACKEND == "sqlite":
+            _search_backend = SQLiteSearchBackend(
+                config.SEARCH_DB_SQLITE_PATH, timeout=config.SEARCH_DB_TIMEOUT
+            )
+        else:
+            _search_backend = ZincSearchBackend(
+                config.SEARCH_DB_URI,
+                config.SEARCH_DB_USER,
+                config.SEARCH_DB_PASSWORD,
+                pool_size=config.SEARCH_DB_POOL_SIZE,
+                timeout=config.SEARCH_DB_TIMEOUT,
+                retries=config.SEARCH_DB_RETRIES,
+                retry_backoff=config.SEARCH_DB_RETRY_BACKOFF,
+                gzip_bulk=config.SEARCH_DB_GZIP_BULK,
+            )
+        _search_backend_pid = os.getpid()
+    return _search_backend
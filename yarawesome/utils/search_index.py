@@ -1,18 +1,171 @@
+import base64
 import json
+import itertools
 import os
 import typing
+from hashlib import sha256
 
 import requests
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import IntegrityError
 
-from apps.rules.models import YaraRule
+from apps.rule_collections import tasks as rule_collections_tasks
+from apps.rules.models import ImportYaraRuleJob, YaraRule, YaraRuleCollection
 from yarawesome import config
 
-from . import database
+from . import database, search_backends
 
 rule_search_index = "yara-rules"
 
+# Fields used to filter rules, rather than to search their text.
+yara_rules_index_mappings = {
+    "properties": {
+        "rule_id": {"type": "keyword"},
+        "collection_id": {"type": "keyword"},
+        "import_id": {"type": "keyword"},
+        "user_id": {"type": "keyword"},
+        "public": {"type": "boolean"},
+    }
+}
+# Filter prefixes accepted in search terms, and the document field each one filters on.
+yara_rules_filter_prefixes = {
+    "collection_id:": "collection_id",
+    "import_id:": "import_id",
+}
+
+_ensured_indexes = set()
+# The field each index sorts rule_id on. Indexes created before rule_id was mapped as a keyword have it
+# dynamically mapped as text, which cannot be sorted on; their keyword sub-field is used instead.
+_rule_id_sort_fields = {}
+
+# Incremented whenever the public index changes; part of every cached public search key.
+public_search_generation_key = "public-yara-rules-search-generation"
+
+
+def get_yara_rules_index_name(user: typing.Optional[User] = None) -> str:
+    """
+    Get the name of the index holding a user's rules, or the shared index of public rules.
+
+    Args:
+        user: The user owning the index.
+
+    Returns:
+        str: The name of the index.
+    """
+    if user:
+        return f"{user.id}-{rule_search_index}"
+    return rule_search_index
+
+
+def ensure_yara_rules_index(index_name: str) -> None:
+    """
+    Create a YARA rules index with its filter fields mapped as keywords, once per process.
+
+    Args:
+        index_name: The name of the index.
+    """
+    if index_name in _ensured_indexes:
+        return
+    response = search_backends.get_search_backend().create_index(
+        index_name, {"mappings": yara_rules_index_mappings}
+    )
+    if response.status_code != 200 and "already exists" not in response.text:
+        # Not remembered, so the next write tries again.
+        print(
+            f"Creating index {index_name} failed with status code {response.status_code}: {response.text}"
+        )
+        return
+    _ensured_indexes.add(index_name)
+
+
+def get_yara_rules_index_rule_id_sort_field(index_name: str) -> str:
+    """
+    Get the field a YARA rules index sorts rule_id on, from its mapping, once per process.
+
+    Args:
+        index_name: The name of the index.
+
+    Returns:
+        str: rule_id, or rule_id.keyword if the index maps rule_id as text.
+    """
+    if index_name in _rule_id_sort_fields:
+        return _rule_id_sort_fields[index_name]
+    response = search_backends.get_search_backend().get_mapping(index_name)
+    if response.status_code != 200:
+        # A missing index will be created with rule_id mapped as a keyword.
+        return "rule_id"
+    rule_id_mapping = (
+        response.json()
+        .get(index_name, {})
+        .get("mappings", {})
+        .get("properties", {})
+        .get("rule_id", {})
+    )
+    if rule_id_mapping.get("type", "keyword") == "keyword":
+        sort_field = "rule_id"
+    else:
+        sort_field = "rule_id.keyword"
+    _rule_id_sort_fields[index_name] = sort_field
+    return sort_field
+
+
+def get_yara_rule_document_fields(yara_rule: YaraRule) -> dict:
+    """
+    Get the filter fields indexed alongside a YARA rule's parsed contents.
+
+    Args:
+        yara_rule: The YaraRule instance.
+
+    Returns:
+        dict: The filter fields of the document.
+    """
+    return {
+        "collection_id": str(yara_rule.collection_id or ""),
+        "import_id": str(yara_rule.import_job_id),
+        "user_id": str(yara_rule.user_id),
+        "public": yara_rule.public,
+    }
+
+
+def get_parsed_yara_rule_search_fields(parsed_yara_rule: dict) -> dict:
+    """
+    Get the searchable fields of a rule parsed by plyara.
+
+    Args:
+        parsed_yara_rule: The rule as parsed by plyara.
+
+    Returns:
+        dict: The name, condition, imports, string variables and values, and metadata of the rule.
+    """
+    search_fields = {
+        "name": parsed_yara_rule["rule_name"],
+        "condition": " ".join(parsed_yara_rule.get("condition_terms", [])),
+        "imports": parsed_yara_rule.get("imports", []),
+        "variables": [item["name"] for item in parsed_yara_rule.get("strings", [])],
+        "values": [item["value"] for item in parsed_yara_rule.get("strings", [])],
+    }
+    for meta_item in parsed_yara_rule.get("metadata", []):
+        search_fields[list(meta_item.keys())[0]] = list(meta_item.values())[0]
+    return search_fields
+
+
+def get_yara_rule_document(yara_rule: YaraRule) -> dict:
+    """
+    Build the search document of a stored YARA rule from its stored parse.
+
+    Args:
+        yara_rule: The YaraRule instance.
+
+    Returns:
+        dict: The document.
+    """
+    return {
+        "rule_id": yara_rule.rule_id,
+        **get_parsed_yara_rule_search_fields(database.get_parsed_yara_rule(yara_rule)),
+        **get_yara_rule_document_fields(yara_rule),
+    }
+
 
 def bulk_index_yara_rules(
     yara_rules: typing.List[dict],
@@ -33,6 +186,8 @@ def bulk_index_yara_rules(
     try:
         success = True
         num_documents = len(yara_rules)
+        index_name = get_yara_rules_index_name(user)
+        ensure_yara_rules_index(index_name)
 
         for i in range(0, num_documents, chunk_size):
             # Split the documents list into chunks
@@ -43,26 +198,16 @@ def bulk_index_yara_rules(
             for doc in chunk:
                 index_action = {
                     "index": {
-                        "_index": rule_search_index,
+                        "_index": index_name,
                     }
                 }
+                if doc.get("rule_id"):
+                    index_action["index"]["_id"] = doc["rule_id"]
                 bulk_data.append(index_action)
                 bulk_data.append(doc)
 
-            # Combine the bulk data into a single JSON string
-            bulk_data_str = "\n".join(map(lambda x: json.dumps(x), bulk_data))
-            # Create the URL for the bulk insert request
-            bulk_url = f"{config.SEARCH_DB_URI}/{rule_search_index}/_bulk"
-            if user:
-                bulk_url = f"{config.SEARCH_DB_URI}/{user.id}-{rule_search_index}/_bulk"
-
-            # Send the bulk insert request to Elasticsearch
-            response = requests.post(
-                bulk_url,
-                headers={"Content-Type": "application/x-ndjson"},
-                data=bulk_data_str,
-                auth=(config.SEARCH_DB_USER, config.SEARCH_DB_PASSWORD),
-            )
+            # Send the bulk insert request to the search backend
+            response = search_backends.get_search_backend().bulk(index_name, bulk_data)
             if response.status_code != 200:
                 success = False
                 print(
@@ -76,40 +221,332 @@ def bulk_index_yara_rules(
         return False
 
 
-def get_rule_ids_in_collection(collection_id: int) -> typing.List[str]:
+def bulk_delete_yara_rules(
+    document_ids: typing.List[str],
+    chunk_size: int = 200,
+    user: typing.Optional[User] = None,
+) -> bool:
     """
-    Get the rule IDs in a collection.
+    Bulk delete documents from a user's index, or the public index, in chunks.
+
     Args:
-        collection_id: The ID of the collection.
+        document_ids (list): The ids of the documents to delete; the rule_id, for documents indexed by this module.
+        chunk_size (int): The maximum number of documents to include in each bulk request.
+        user: The user owning the index.
 
     Returns:
-        List[str]: A list of rule IDs.
+        bool: True if all bulk deletes were successful, False otherwise.
     """
     try:
-        rule_ids = YaraRule.objects.filter(collection__id=collection_id).values_list(
-            "rule_id", flat=True
+        success = True
+        index_name = get_yara_rules_index_name(user)
+        for i in range(0, len(document_ids), chunk_size):
+            bulk_data = [
+                {"delete": {"_index": index_name, "_id": document_id}}
+                for document_id in document_ids[i : i + chunk_size]
+            ]
+            response = search_backends.get_search_backend().bulk(index_name, bulk_data)
+            if response.status_code != 200:
+                success = False
+                print(
+                    f"Bulk delete failed with status code {response.status_code}: {response.text}"
+                )
+        return success
+
+    except Exception as e:
+        print(f"Error during bulk delete: {e}")
+        return False
+
+
+def iter_yara_rules_index_documents(
+    query: dict,
+    user: typing.Optional[User] = None,
+    page_size: int = 1000,
+) -> typing.Iterator[dict]:
+    """
+    Iterate over every document in a user's index, or the public index, matching a query, ordered by rule_id.
+    Pages are fetched with search_after, so the iteration is not limited by the maximum result window.
+
+    Args:
+        query (dict): The query.
+        user: The user owning the index.
+        page_size (int): The number of documents to fetch per request.
+
+    Returns:
+        Iterator[dict]: Each matching hit, with the document in its _source.
+    """
+    index_name = get_yara_rules_index_name(user)
+    search_payload = {
+        "query": query,
+        "sort": [{get_yara_rules_index_rule_id_sort_field(index_name): "asc"}],
+        "size": page_size,
+    }
+    while True:
+        response = search_backends.get_search_backend().search(
+            index_name, search_payload
+        )
+        # The index does not exist until a rule is first indexed into it.
+        if response.status_code == 404:
+            return
+        if response.status_code != 200:
+            print(
+                f"Index scan failed with status code {response.status_code}: {response.text}"
+            )
+            return
+        hits = response.json().get("hits", {}).get("hits", [])
+        yield from hits
+        if len(hits) < page_size:
+            return
+        search_payload["search_after"] = hits[-1].get("sort") or [
+            hits[-1]["_source"]["rule_id"]
+        ]
+
+
+def sync_yara_rules_index_documents(
+    rule_ids: typing.Iterable[str],
+    user: typing.Optional[User] = None,
+) -> bool:
+    """
+    Bring the documents of a set of rule_ids in a user's index, or the public index, in line with the database.
+    A rule_id the user (or, for the public index, anyone publicly) still has is re-indexed from the first such
+    rule; every other rule_id is deleted. Re-running a sync is harmless, as documents are keyed by rule_id.
+
+    Args:
+        rule_ids: The rule_ids of the documents to sync.
+        user: The user owning the index.
+
+    Returns:
+        bool: True if all bulk requests were successful, False otherwise.
+    """
+    rule_ids = set(rule_ids)
+    yara_rules = (
+        YaraRule.objects.filter(rule_id__in=rule_ids)
+        .select_related("body")
+        .order_by("id")
+    )
+    if user:
+        yara_rules = yara_rules.filter(user=user)
+    else:
+        yara_rules = yara_rules.filter(public=True)
+    yara_rules_by_rule_id = {}
+    for yara_rule in yara_rules:
+        yara_rules_by_rule_id.setdefault(yara_rule.rule_id, yara_rule)
+
+    success = True
+    if yara_rules_by_rule_id:
+        success &= bulk_index_yara_rules(
+            [
+                get_yara_rule_document(yara_rule)
+                for yara_rule in yara_rules_by_rule_id.values()
+            ],
+            config.SEARCH_DB_BULK_SIZE,
+            user=user,
+        )
+    removed_rule_ids = sorted(rule_ids - yara_rules_by_rule_id.keys())
+    if removed_rule_ids:
+        success &= bulk_delete_yara_rules(
+            removed_rule_ids, config.SEARCH_DB_BULK_SIZE, user=user
+        )
+    if not user and rule_ids:
+        bump_public_search_generation()
+    return success
+
+
+def remove_yara_rule_collection_from_public_index(collection_id: int) -> bool:
+    """
+    Remove an unpublished collection's documents from the public index. Documents are found by their collection_id,
+    so rules deleted since the collection was published are removed too.
+
+    Args:
+        collection_id (int): The id of the collection.
+
+    Returns:
+        bool: True if all bulk requests were successful, False otherwise.
+    """
+    success = True
+    rule_ids = []
+    for hit in iter_yara_rules_index_documents(
+        {"bool": {"filter": [{"term": {"collection_id": str(collection_id)}}]}},
+        page_size=config.SEARCH_DB_BULK_SIZE,
+    ):
+        rule_ids.append(hit["_source"]["rule_id"])
+        if len(rule_ids) == config.SEARCH_DB_BULK_SIZE:
+            success &= sync_yara_rules_index_documents(rule_ids)
+            rule_ids = []
+    if rule_ids:
+        success &= sync_yara_rules_index_documents(rule_ids)
+    return success
+
+
+def reconcile_yara_rules_index(user: typing.Optional[User] = None) -> dict:
+    """
+    Compare a user's index, or the public index, against the database, and fix any drift: documents of rules that
+    no longer exist (or are no longer public) are deleted, and rules missing from the index are indexed.
+
+    Both sides are streamed in rule_id order and merged, so neither is loaded into memory at once. Drifted rule_ids
+    are synced against the database before anything is deleted, so an ordering difference between the database
+    and the search backend can only cause extra work, never a lost document.
+
+    Args:
+        user: The user owning the index.
+
+    Returns:
+        dict: The number of orphaned, missing and stray documents found.
+    """
+    yara_rules = YaraRule.objects.all()
+    if user:
+        yara_rules = yara_rules.filter(user=user)
+    else:
+        yara_rules = yara_rules.filter(public=True)
+    database_rule_ids = iter(
+        yara_rules.order_by("rule_id")
+        .values_list("rule_id", flat=True)
+        .distinct()
+        .iterator(chunk_size=config.SEARCH_DB_BULK_SIZE)
+    )
+    # Documents indexed before _id was set to the rule_id are deleted by their own _id. They do not count as
+    # indexing their rule, so a rule only they refer to is indexed again.
+    stray_document_ids = []
+    drift = {"orphaned": 0, "missing": 0, "stray": 0}
+
+    def delete_stray_documents() -> None:
+        bulk_delete_yara_rules(
+            stray_document_ids, config.SEARCH_DB_BULK_SIZE, user=user
+        )
+        drift["stray"] += len(stray_document_ids)
+        stray_document_ids.clear()
+
+    def iter_index_rule_ids() -> typing.Iterator[str]:
+        last_rule_id = None
+        for hit in iter_yara_rules_index_documents(
+            {"match_all": {}}, user=user, page_size=config.SEARCH_DB_BULK_SIZE
+        ):
+            rule_id = hit["_source"].get("rule_id")
+            if hit.get("_id") != rule_id:
+                stray_document_ids.append(hit["_id"])
+                if len(stray_document_ids) == config.SEARCH_DB_BULK_SIZE:
+                    delete_stray_documents()
+                continue
+            if rule_id and rule_id != last_rule_id:
+                last_rule_id = rule_id
+                yield rule_id
+
+    index_rule_ids = iter_index_rule_ids()
+    drifted_rule_ids = []
+    index_rule_id = next(index_rule_ids, None)
+    database_rule_id = next(database_rule_ids, None)
+    while index_rule_id is not None or database_rule_id is not None:
+        if database_rule_id is None or (
+            index_rule_id is not None and index_rule_id < database_rule_id
+        ):
+            drift["orphaned"] += 1
+            drifted_rule_ids.append(index_rule_id)
+            index_rule_id = next(index_rule_ids, None)
+        elif index_rule_id is None or database_rule_id < index_rule_id:
+            drift["missing"] += 1
+            drifted_rule_ids.append(database_rule_id)
+            database_rule_id = next(database_rule_ids, None)
+        else:
+            index_rule_id = next(index_rule_ids, None)
+            database_rule_id = next(database_rule_ids, None)
+        if len(drifted_rule_ids) == config.SEARCH_DB_BULK_SIZE:
+            sync_yara_rules_index_documents(drifted_rule_ids, user=user)
+            drifted_rule_ids = []
+    if drifted_rule_ids:
+        sync_yara_rules_index_documents(drifted_rule_ids, user=user)
+    if stray_document_ids:
+        delete_stray_documents()
+    return drift
+
+
+def index_yara_rule_collection(
+    yara_rule_collection: YaraRuleCollection,
+    on_progress: typing.Optional[typing.Callable[[int, int], None]] = None,
+) -> bool:
+    """
+    Re-index every rule in a collection into its owner's index, and into the public index if it is published.
+    Unpublished collections are removed from the public index.
+
+    Args:
+        yara_rule_collection: The YaraRuleCollection instance.
+        on_progress: Called with the number of rules indexed so far and the total after each chunk.
+
+    Returns:
+        bool: True if all bulk inserts were successful, False otherwise.
+    """
+    yara_rules = yara_rule_collection.yararule_set.select_related(
+        "body", "user"
+    ).order_by("id")
+    total = yara_rules.count()
+    users = [yara_rule_collection.user]
+    if yara_rule_collection.public:
+        users.append(None)
+    success = True
+    chunk = []
+    indexed = 0
+    for yara_rule in yara_rules.iterator(chunk_size=config.SEARCH_DB_BULK_SIZE):
+        chunk.append(get_yara_rule_document(yara_rule))
+        if len(chunk) < config.SEARCH_DB_BULK_SIZE:
+            continue
+        for user in users:
+            success &= bulk_index_yara_rules(chunk, len(chunk), user=user)
+        indexed += len(chunk)
+        chunk = []
+        if on_progress:
+            on_progress(indexed, total)
+    if chunk:
+        for user in users:
+            success &= bulk_index_yara_rules(chunk, len(chunk), user=user)
+        indexed += len(chunk)
+    if on_progress:
+        on_progress(indexed, total)
+    if not yara_rule_collection.public:
+        success &= remove_yara_rule_collection_from_public_index(
+            yara_rule_collection.id
         )
-    except YaraRule.DoesNotExist:
-        return []
-    return rule_ids
+    bump_public_search_generation()
+    return success
 
 
-def get_rule_ids_in_import_job(import_id: int) -> typing.List[str]:
+def encode_search_cursor(sort_values: list) -> str:
     """
-    Get the rule IDs in an import job.
+    Encode the sort values of the last hit of a page as an opaque cursor to the next page.
+
     Args:
-        import_id: The ID of the import job.
+        sort_values (list): The sort values of the hit.
 
     Returns:
-        List[str]: A list of rule IDs.
+        str: The cursor.
+    """
+    return (
+        base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8"))
+        .decode("utf-8")
+        .rstrip("=")
+    )
+
+
+def decode_search_cursor(cursor: str) -> list:
+    """
+    Decode a cursor returned by encode_search_cursor.
+
+    Args:
+        cursor (str): The cursor.
+
+    Returns:
+        list: The sort values to search after.
+
+    Raises:
+        ValueError: If the cursor is malformed.
     """
     try:
-        rule_ids = YaraRule.objects.filter(import_job__id=import_id).values_list(
-            "rule_id", flat=True
+        sort_values = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
         )
-    except YaraRule.DoesNotExist:
-        return []
-    return rule_ids
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(sort_values, list):
+        raise ValueError("Invalid cursor.")
+    return sort_values
 
 
 def contextualize_yara_rules_search_response(
@@ -118,6 +555,7 @@ def contextualize_yara_rules_search_response(
     start: int,
     max_results: int,
     user: typing.Optional[User] = None,
+    cursor: typing.Optional[str] = None,
 ) -> dict:
     """
     Contextualize the search response with additional information from our database.
@@ -128,49 +566,47 @@ def contextualize_yara_rules_search_response(
         start: The starting index of results.
         response (requests.Response): The API response.
         term (str): The search term.
+        cursor (str): The cursor the page was fetched with.
 
     Returns:
-        dict: Parsed search results.
+        dict: Parsed search results, with a next_cursor to the following page if the page is full.
     """
+    response_json = response.json()
+    hits = response_json.get("hits", {}).get("hits", [])
+    yara_rules = (
+        YaraRule.objects.filter(rule_id__in=[hit["_source"]["rule_id"] for hit in hits])
+        .select_related("collection", "body")
+        .order_by("id")
+    )
+    if user:
+        yara_rules = yara_rules.filter(user=user)
+    else:
+        yara_rules = yara_rules.filter(public=True)
+    yara_rules_by_rule_id = {}
+    for yara_rule in yara_rules:
+        yara_rules_by_rule_id.setdefault(yara_rule.rule_id, yara_rule)
+
     results = []
-    for hit in response.json().get("hits", {}).get("hits", []):
+    for hit in hits:
         collection = {}
-        yara_rule_collection = (
-            YaraRule.objects.filter(
-                rule_id=hit["_source"]["rule_id"], user=user
-            ).first()
-            if user
-            else YaraRule.objects.filter(
-                rule_id=hit["_source"]["rule_id"], public=True
-            ).first()
-        )
-        if yara_rule_collection:
+        yara_rule = yara_rules_by_rule_id.get(hit["_source"]["rule_id"])
+        if yara_rule and yara_rule.collection:
             collection = {
-                "id": yara_rule_collection.collection.id,
-                "name": yara_rule_collection.collection.name,
+                "id": yara_rule.collection.id,
+                "name": yara_rule.collection.name,
             }
-        try:
+        if yara_rule:
             results.append(
                 {
                     "id": hit["_source"]["rule_id"],
                     "name": hit["_source"]["name"],
                     "collection": collection,
                     "description": hit["_source"].get("description", ""),
-                    "rule": YaraRule.objects.filter(
-                        rule_id=hit["_source"]["rule_id"], user=user
-                    )
-                    .first()
-                    .content
-                    if user
-                    else YaraRule.objects.filter(
-                        rule_id=hit["_source"]["rule_id"], public=True
-                    )
-                    .first()
-                    .content,
+                    "rule": yara_rule.content,
                 }
             )
-        except Exception as e:
-            print("Orphaned rule found in search index.", e)
+        else:
+            print("Orphaned rule found in search index.", hit["_source"]["rule_id"])
             results.append(
                 {
                     "id": hit["_source"]["rule_id"],
@@ -182,42 +618,52 @@ def contextualize_yara_rules_search_response(
                     "and will be removed from the index soon.",
                 }
             )
-    if term.strip().startswith("import_id:"):
-        import_id = int(term.strip().split(":")[1])
-        available = (
-            YaraRule.objects.filter(import_job__id=import_id, user=user).count()
-            if user
-            else YaraRule.objects.filter(import_job__id=import_id, public=True).count()
-        )
-    elif term.strip().startswith("collection_id:"):
-        collection_id = int(term.strip().split(":")[1])
-        available = (
-            YaraRule.objects.filter(collection__id=collection_id, user=user).count()
-            if user
-            else YaraRule.objects.filter(
-                collection__id=collection_id, public=True
-            ).count()
+    available = response_json.get("hits", {}).get("total", {}).get("value", 0)
+    next_cursor = None
+    if hits and len(hits) == max_results:
+        next_cursor = encode_search_cursor(
+            hits[-1].get("sort")
+            or [hits[-1]["_source"].get("@timestamp"), hits[-1]["_source"]["rule_id"]]
         )
-    else:
-        available = response.json().get("hits", {}).get("total", {}).get("value", 0)
     return {
         "search_parameters": {
             "term": term,
             "start": start,
             "max_results": max_results,
+            "cursor": cursor,
         },
-        "search_time": response.json().get("hits", {}).get("took", 0),
+        "next_cursor": next_cursor,
+        "search_time": response_json.get("hits", {}).get("took", 0),
         "available": available,
         "displayed": len(results),
         "results": results,
     }
 
 
+def build_yara_rules_query(term: str) -> dict:
+    """
+    Translate a search term into a query. "collection_id:<id>" and "import_id:<id>" become term filters on the
+    indexed fields, anything else is passed through as a query string.
+
+    Args:
+        term (str): The search term.
+
+    Returns:
+        dict: The query.
+    """
+    for prefix, field in yara_rules_filter_prefixes.items():
+        if term.strip().startswith(prefix):
+            parent_id = int(term.strip().split(":")[1])
+            return {"bool": {"filter": [{"term": {field: str(parent_id)}}]}}
+    return {"bool": {"must": [{"query_string": {"query": term}}]}}
+
+
 def search_yara_rules_index(
     term: str,
     start: int = 0,
     max_results: int = 100,
     user: typing.Optional[User] = None,
+    cursor: typing.Optional[str] = None,
 ) -> requests.Response:
     """
     Make a search request to the ElasticSearch / ZincSearch backend.
@@ -227,49 +673,165 @@ def search_yara_rules_index(
         term (str): The search term.
         start (int, optional): Starting index of results. Defaults to 0.
         max_results (int, optional): Maximum number of results to retrieve. Defaults to 100.
+        cursor (str, optional): A next_cursor returned with a previous page. When given, the page after it is
+            fetched with search_after and start is ignored, so deep pages cost no more than the first.
 
     Returns:
         requests.Response: The API response.
     """
-    headers = {"Content-Type": "application/json"}
-    search_url = f"{config.SEARCH_DB_URI}/{rule_search_index}/_search"
-    if user:
-        search_url = f"{config.SEARCH_DB_URI}/{user.id}-{rule_search_index}/_search"
-    if term.strip().startswith("import_id:") or term.strip().startswith(
-        "collection_id:"
-    ):
-        parent_id = int(term.strip().split(":")[1])
-        select_function = get_rule_ids_in_import_job
-        if term.strip().startswith("collection_id:"):
-            select_function = get_rule_ids_in_collection
-
-        query_strings = [
-            {"query_string": {"query": rule_id}}
-            for rule_id in select_function(parent_id)
+    index_name = get_yara_rules_index_name(user)
+    # rule_id breaks ties between rules indexed at the same time, so a cursor never skips a hit.
+    search_payload = {
+        "query": build_yara_rules_query(term),
+        "sort": ["-@timestamp", get_yara_rules_index_rule_id_sort_field(index_name)],
+        "from": start,
+        "size": max_results,
+    }
+    if cursor:
+        search_payload["from"] = 0
+        search_payload["search_after"] = decode_search_cursor(cursor)
+
+    return search_backends.get_search_backend().search(index_name, search_payload)
+
+
+def get_public_search_generation() -> int:
+    """
+    Get the current generation of the public index.
+
+    Returns:
+        int: The generation.
+    """
+    return cache.get_or_set(public_search_generation_key, 1, timeout=None)
+
+
+def bump_public_search_generation() -> None:
+    """
+    Invalidate every cached public search, by moving on to the next generation of the public index.
+    """
+    try:
+        cache.incr(public_search_generation_key)
+    except ValueError:
+        # The generation was evicted; so were the searches cached under it.
+        cache.add(public_search_generation_key, 1, timeout=None)
+
+
+def search_public_yara_rules(
+    term: str,
+    start: int = 0,
+    max_results: int = 100,
+    cursor: typing.Optional[str] = None,
+) -> typing.Tuple[int, typing.Optional[dict]]:
+    """
+    Search the public index, caching the contextualized results for SEARCH_RESULT_CACHE_TIMEOUT seconds.
+    Cached results are discarded whenever the public index changes.
+
+    Args:
+        term (str): The search term.
+        start (int, optional): Starting index of results. Defaults to 0.
+        max_results (int, optional): Maximum number of results to retrieve. Defaults to 100.
+        cursor (str, optional): A next_cursor returned with a previous page.
+
+    Returns:
+        tuple: The status code of the search backend, and the contextualized results if it succeeded.
+    """
+    cache_key = "public-yara-rules-search:{}:{}:{}:{}".format(
+        get_public_search_generation(),
+        sha256(f"{term}\n{cursor or ''}".encode("utf-8")).hexdigest(),
+        start,
+        max_results,
+    )
+    search_results = cache.get(cache_key)
+    if search_results is not None:
+        return 200, search_results
+    response = search_yara_rules_index(
+        term, start, max_results, user=None, cursor=cursor
+    )
+    if response.status_code != 200:
+        return response.status_code, None
+    search_results = contextualize_yara_rules_search_response(
+        response, term, start, max_results, user=None, cursor=cursor
+    )
+    cache.set(cache_key, search_results, config.SEARCH_RESULT_CACHE_TIMEOUT)
+    return 200, search_results
+
+
+def prepend_yara_rule_imports(parsed_rule: dict) -> dict:
+    """
+    Prepend the import statements a parsed YARA rule uses to its content, so the rule compiles on its own.
+
+    Args:
+        parsed_rule (dict): A dictionary containing parsed YARA rule information.
+
+    Returns:
+        dict: The parsed rule.
+    """
+    if parsed_rule.get("imports", []):
+        _import_str = ""
+        for _import in parsed_rule.get("imports", []):
+            if f"{_import}." in parsed_rule["content"]:
+                _import_str += f'import "{_import}"\n'
+        parsed_rule["content"] = _import_str + "\n" + parsed_rule["content"]
+    return parsed_rule
+
+
+def bulk_index_imported_yara_rules(
+    parsed_rules: typing.Iterable[dict],
+    collection_name: str,
+    import_id: int,
+) -> int:
+    """
+    Write a directory's worth of imported YARA rules to the database and the search backend in bulk.
+    Rules are consumed SEARCH_DB_BULK_SIZE at a time, so a generator of rules is never held in memory at once.
+
+    Args:
+        parsed_rules (iterable): Dictionaries containing parsed YARA rule information.
+        collection_name (str): The name of the collection to index the rules into.
+        import_id (int): The ID of the import job.
+
+    Returns:
+        int: The number of rules processed.
+    """
+    try:
+        import_job = ImportYaraRuleJob.objects.get(id=import_id)
+    except ImportYaraRuleJob.DoesNotExist:
+        # This can occur when the import job is deleted.
+        return 0
+    yara_rule_collection = database.get_or_create_import_collection(
+        import_job, collection_name
+    )
+    document_fields = {
+        "collection_id": str(yara_rule_collection.id),
+        "import_id": str(import_job.id),
+        "user_id": str(import_job.user_id),
+        "public": False,
+    }
+    indexed = 0
+    parsed_rules = iter(parsed_rules)
+    while True:
+        chunk = list(itertools.islice(parsed_rules, config.SEARCH_DB_BULK_SIZE))
+        if not chunk:
+            break
+        for parsed_rule in chunk:
+            prepend_yara_rule_imports(parsed_rule)
+        yara_rules = database.bulk_write_yara_rule_records(
+            chunk, import_job, yara_rule_collection
+        )
+        documents = [
+            {
+                **{
+                    key: value
+                    for key, value in parsed_rule.items()
+                    if key not in ("content", "parsed")
+                },
+                **document_fields,
+            }
+            for parsed_rule in chunk
         ]
-        query = {"bool": {"should": query_strings[start : start + max_results]}}
-        search_payload = {
-            "query": query,
-            "sort": ["-@timestamp"],
-            "from": 0,
-            "size": max_results,
-        }
-    else:
-        query = {"bool": {"must": [{"query_string": {"query": term}}]}}
-        search_payload = {
-            "query": query,
-            "sort": ["-@timestamp"],
-            "from": start,
-            "size": max_results,
-        }
-
-    with requests.post(
-        url=search_url,
-        json=search_payload,
-        headers=headers,
-        auth=(config.SEARCH_DB_USER, config.SEARCH_DB_PASSWORD),
-    ) as response:
-        return response
+        bulk_index_yara_rules(
+            documents, chunk_size=config.SEARCH_DB_BULK_SIZE, user=import_job.user
+        )
+        indexed += len(yara_rules)
+    return indexed
 
 
 def index_yara_rule(
@@ -292,31 +854,64 @@ def index_yara_rule(
     """
     if not os.path.exists(config.YARA_RULES_COLLECTIONS_DIRECTORY):
         os.mkdir(config.YARA_RULES_COLLECTIONS_DIRECTORY)
-    if parsed_rule.get("imports", []):
-        _import_str = ""
-        for _import in parsed_rule.get("imports", []):
-            if f"{_import}." in parsed_rule["content"]:
-                _import_str += f'import "{_import}"\n'
-        parsed_rule["content"] = _import_str + "\n" + parsed_rule["content"]
-    headers = {"Content-Type": "application/json"}
+    prepend_yara_rule_imports(parsed_rule)
     try:
         yara_rule_db = database.write_yara_rule_record(
             parsed_rule, user=user, collection_name=collection_name, import_id=import_id
         )
     except IntegrityError:
         return None
+    if not yara_rule_db:
+        return None
+    if yara_rule_db.collection_id:
+        rule_collections_tasks.schedule_yara_rule_collection_artifacts(
+            yara_rule_db.collection_id
+        )
 
-    create_document_with_id_url = (
-        f"{config.SEARCH_DB_URI}/{rule_search_index}/_doc/{parsed_rule['rule_id']}"
+    parsed_rule.pop("content")
+    parsed_rule.pop("parsed", None)
+    parsed_rule.update(get_yara_rule_document_fields(yara_rule_db))
+    index_name = get_yara_rules_index_name(yara_rule_db.user)
+    ensure_yara_rules_index(index_name)
+    return search_backends.get_search_backend().put_document(
+        index_name,
+        parsed_rule["rule_id"],
+        parsed_rule,
     )
-    if yara_rule_db.user.id:
-        create_document_with_id_url = f"{config.SEARCH_DB_URI}/{yara_rule_db.user.id}-yara-rules/_doc/{parsed_rule['rule_id']}"
 
-    parsed_rule.pop("content")
-    with requests.put(
-        url=create_document_with_id_url,
-        json=parsed_rule,
-        headers=headers,
-        auth=(config.SEARCH_DB_USER, config.SEARCH_DB_PASSWORD),
-    ) as response:
-        return response
+
+def delete_yara_rule(yara_rule: YaraRule) -> None:
+    """
+    Delete a YARA rule from the database and the search backend.
+
+    Args:
+        yara_rule: The YaraRule instance.
+    """
+    delete_yara_rules([yara_rule])
+
+
+def delete_yara_rules(yara_rules: typing.Iterable[YaraRule]) -> None:
+    """
+    Delete YARA rules from the database and the search backend.
+
+    Args:
+        yara_rules: The YaraRule instances.
+    """
+    yara_rules = list(yara_rules)
+    database.delete_yara_rule_records(yara_rules)
+    # The same rules may remain in another of the user's (or another public) collection.
+    rule_ids_by_user = {}
+    public_rule_ids = set()
+    for yara_rule in yara_rules:
+        rule_ids_by_user.setdefault(yara_rule.user, set()).add(yara_rule.rule_id)
+        if yara_rule.public:
+            public_rule_ids.add(yara_rule.rule_id)
+    for user, rule_ids in rule_ids_by_user.items():
+        sync_yara_rules_index_documents(rule_ids, user=user)
+    if public_rule_ids:
+        sync_yara_rules_index_documents(public_rule_ids)
+    for collection_id in {yara_rule.collection_id for yara_rule in yara_rules}:
+        if collection_id:
+            rule_collections_tasks.schedule_yara_rule_collection_artifacts(
+                collection_id
+            )